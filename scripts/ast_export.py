@@ -3,18 +3,20 @@
 import sys
 
 import argparse
+import cgpm_model
 import edn_format
 import json
 import math
+import numpy as np
 import pandas as pd
-import sppl.math_util as math_util
 
-from collections import Counter
 from collections import OrderedDict
+from edn_cache import load_edn
 
 
-def read_metadata(f):
-    metadata = json.load(f)
+def read_metadata(path):
+    # The data matrix isn't needed for exporting.
+    metadata = cgpm_model.read_metadata(path, arrays=("Zrv",))
 
     # When serializing its metadata to JSON CGPM represents some dictionaries
     # as lists of pairs. When deserializing them we need to do the conversion
@@ -55,211 +57,327 @@ def view_assignments_to_view_partition(view_assignments):
     return partition
 
 
-def export_primitive(output, cctype, hypers, suffstats, distargs, categorical_mapping):
+def cluster_weights(Zr, alpha):
+    """Return the cluster ids of a view, including one new cluster, and their
+    CRP weights."""
+    Zr = np.asarray(Zr, dtype=np.int64)
+    tables_existing, counts = np.unique(Zr, return_counts=True)
+    table_aux = tables_existing[-1] + 1 if len(tables_existing) > 0 else 0
+    tables = tables_existing.tolist() + [int(table_aux)]
+    weights = np.append(counts.astype(float), alpha)
+    return tables, weights / weights.sum()
+
+
+def export_distribution(cctype, hypers, suffstats, distargs, tables):
+    """Compute the posterior predictive distributions of one column in all
+    `tables` (clusters) at once. Returns the distribution type and a dict of
+    parameters, each an array with one entry (row) per cluster."""
+    n = len(tables)
+
+    def stat(key):
+        return np.array([suffstats[z][key] for z in tables], dtype=float)
+
     if cctype == "bernoulli":
         alpha = hypers["alpha"]
         beta = hypers["beta"]
-        N = suffstats["N"]
-        x_sum = suffstats["x_sum"]
-        # Compute the distribution.
-        p = (x_sum + alpha) / (N + alpha + beta)
-        dist = {
-            edn_format.Keyword("distribution/type"): edn_format.Keyword(
-                "distribution.type/bernoulli"
-            ),
-            edn_format.Keyword("bernoulli/p"): p,
-        }
+        p = (stat("x_sum") + alpha) / (stat("N") + alpha + beta)
+        return "bernoulli", {"bernoulli/p": p}
 
     elif cctype == "beta":
         strength = hypers["strength"]
         balance = hypers["balance"]
-        # Compute the distribution.
-        alpha = strength * balance
-        beta = strength * (1.0 - balance)
-        dist = {
-            edn_format.Keyword("distribution/type"): edn_format.Keyword(
-                "distribution.type/beta"
-            ),
-            edn_format.Keyword("beta/alpha"): alpha,
-            edn_format.Keyword("beta/beta"): beta,
+        return "beta", {
+            "beta/alpha": np.full(n, strength * balance),
+            "beta/beta": np.full(n, strength * (1.0 - balance)),
         }
 
     elif cctype == "categorical":
         k = distargs["k"]
-        alpha = hypers["alpha"]
-        N = suffstats["N"]
-        counts = suffstats["counts"]
-        # Compute the distribution.
-        weights = [alpha + counts[i] for i in range(k)]
-        norm = sum(weights)
-        if categorical_mapping is None:
-            keys = map(str, range(k))
-        else:
-            keys = [categorical_mapping[output][j] for j in range(k)]
-        dist = {
-            edn_format.Keyword("distribution/type"): edn_format.Keyword(
-                "distribution.type/categorical"
-            ),
-            edn_format.Keyword("categorical/category->weight"): {
-                key: weight / norm for key, weight in zip(keys, weights)
-            },
-        }
+        counts = np.array([suffstats[z]["counts"][:k] for z in tables], dtype=float)
+        weights = hypers["alpha"] + counts.reshape(n, k)
+        weights /= weights.sum(axis=1, keepdims=True)
+        return "categorical", {"categorical/category->weight": weights}
 
     elif cctype == "crp":
-        alpha = hypers["alpha"]
-        N = suffstats["N"]
-        counts = dict(suffstats["counts"])
-        assert 1 <= len(counts)
-        # Compute the distribution.
-        tables = sorted(counts)
-        weights = [counts[t] for t in tables] + [alpha]
-        norm = sum(weights)
-        keys = map(str, range(len(weights)))
-        dist = {
-            edn_format.Keyword("distribution/type"): edn_format.Keyword(
-                "distribution.type/categorical"
-            ),
-            edn_format.Keyword("categorical/category->weight"): {
-                key: weight / norm for key, weight in zip(keys, weights)
-            },
-        }
+        # Cluster-specific numbers of tables, so there is nothing to stack.
+        rows = []
+        for z in tables:
+            counts = dict(suffstats[z]["counts"])
+            assert 1 <= len(counts)
+            weights = [counts[t] for t in sorted(counts)] + [hypers["alpha"]]
+            rows.append(np.asarray(weights, dtype=float) / sum(weights))
+        return "categorical", {"categorical/category->weight": rows}
 
     elif cctype == "exponential":
-        a = hypers["a"]
-        b = hypers["b"]
-        N = suffstats["N"]
-        sum_x = suffstats["sum_x"]
-        # Compute the distribution.
-        an = a + N
-        bn = b + sum_x
         # See: https://docs.scipy.org/doc/scipy/reference/generated/scipy.stats.lomax.html
-        dist = {
-            edn_format.Keyword("distribution/type"): edn_format.Keyword(
-                "distribution.type/lomax"
-            ),
-            edn_format.Keyword("lomax/c"): an,
-            edn_format.Keyword("lomax/scale"): bn,
+        return "lomax", {
+            "lomax/c": hypers["a"] + stat("N"),
+            "lomax/scale": hypers["b"] + stat("sum_x"),
         }
 
     elif cctype == "geometric":
-        a = hypers["a"]
-        b = hypers["b"]
-        N = suffstats["N"]
-        sum_x = suffstats["sum_x"]
-        # Compute the distribution.
         # The true posterior predictive resembles a beta negative binomial
         # distribution, which is not available in scipy.stats.
         # Thus we will return a geometric distribution centered at the
         # mean of the posterior distribution over the success probability.
-        an = a + N
-        bn = b + sum_x
-        pn = an / (an + bn)
-        dist = distributions.geom(p=pn)
-        dist = {
-            edn_format.Keyword("distribution/type"): edn_format.Keyword(
-                "distribution.type/geometric"
-            ),
-            edn_format.Keyword("geometric/p"): pn,
-        }
+        an = hypers["a"] + stat("N")
+        bn = hypers["b"] + stat("sum_x")
+        return "geometric", {"geometric/p": an / (an + bn)}
 
     elif cctype == "normal":
         m = hypers["m"]
         r = hypers["r"]
         s = hypers["s"]
         nu = hypers["nu"]
-        N = suffstats["N"]
-        sum_x = suffstats["sum_x"]
-        sum_x_sq = suffstats["sum_x_sq"]
-        # Compute the distribution.
+        N = stat("N")
         # Refer to cgpm.tests.test_teh_murphy for the conversion of
         # hyperparameters into the Student T form.
         rn = r + N
         nun = nu + N
-        mn = (r * m + sum_x) / rn
-        sn = s + sum_x_sq + r * m * m - rn * mn * mn
+        mn = (r * m + stat("sum_x")) / rn
+        sn = s + stat("sum_x_sq") + r * m * m - rn * mn * mn
         (an, bn, kn, mun) = (nun / 2, sn / 2, rn, mn)
         scalesq = bn * (kn + 1) / (an * kn)
-        dist = {
-            edn_format.Keyword("distribution/type"): edn_format.Keyword(
-                "distribution.type/student-t"
-            ),
-            edn_format.Keyword("student-t/degrees-of-freedom"): 2 * an,
-            edn_format.Keyword("student-t/location"): mun,
-            edn_format.Keyword("student-t/scale"): math.sqrt(scalesq),
+        return "student-t", {
+            "student-t/degrees-of-freedom": 2 * an,
+            "student-t/location": mun,
+            "student-t/scale": np.sqrt(scalesq),
         }
 
     elif cctype == "poisson":
-        a = hypers["a"]
-        b = hypers["b"]
-        N = suffstats["N"]
-        x_sum = suffstats["x_sum"]
-        # Compute the distribution.
         # The implementation of Poisson.logpdf in CGPM is rather suspicious:
         # https://github.com/probcomp/cgpm/issues/251
-        an = a + sum_x
-        bn = b + N
-        pn = bn / (1.0 + bn)
+        an = hypers["a"] + stat("sum_x")
+        bn = hypers["b"] + stat("N")
         # so, this get's transformed into a negative binominal: https://docs.scipy.org/doc/scipy/reference/generated/scipy.stats.nbinom.html
-        dist = {
-            edn_format.Keyword("distribution/type"): edn_format.Keyword(
-                "distribution.type/negative-binom"
-            ),
-            # Conventionally, the paramters of a binominal are called n and
-            # p. Because math sucks.
-            edn_format.Keyword("negative-binom/n"): an,
-            edn_format.Keyword("negative-binom/p"): pn,
+        # Conventionally, the paramters of a binominal are called n and
+        # p. Because math sucks.
+        return "negative-binom", {
+            "negative-binom/n": an,
+            "negative-binom/p": bn / (1.0 + bn),
         }
 
     else:
         assert False, "Cannot convert primitive: %s " % (cctype,)
 
-    return dist
-
 
-def export_cluster(
-    metadata, categorical_mapping, tables, log_weights, variable_mapping
-):
-    outputs = metadata["outputs"]
-
-    def args(output, z):
-        return (
-            output,
-            metadata["cctypes"][output],
+def export_view(metadata, categorical_mapping, variable_mapping):
+    """Compute the cluster weights and, for every output, the posterior
+    predictive parameters in all clusters of a view."""
+    tables, weights = cluster_weights(metadata["Zr"], metadata["alpha"])
+    distributions = []
+    for output in metadata["outputs"]:
+        cctype = metadata["cctypes"][output]
+        dist_type, params = export_distribution(
+            cctype,
             metadata["hypers"][output],
-            metadata["suffstats"][output][z],
+            metadata["suffstats"][output],
             metadata["distargs"][output],
-            categorical_mapping,
+            tables,
         )
-
-    children_x = [
-        {
-            edn_format.Keyword("cluster/weight"): math.exp(lw),
-            edn_format.Keyword("cluster/column->distribution"): {
-                variable_mapping[output]: export_primitive(*args(output, z))
-                for output in outputs
+        if cctype == "categorical" and categorical_mapping is not None:
+            k = metadata["distargs"][output]["k"]
+            categories = [categorical_mapping[output][j] for j in range(k)]
+        else:
+            categories = None
+        distributions.append(
+            {
+                "column": variable_mapping[output],
+                "type": dist_type,
+                "params": params,
+                "categories": categories,
+            }
+        )
+    return {"weights": weights, "distributions": distributions}
+
+
+def prune_view(view, threshold):
+    """Drop the clusters of a view whose weight is below `threshold` and
+    renormalize the remaining weights. The heaviest cluster is always kept.
+
+    Returns the pruned view and the dropped weight. Dropping clusters with
+    total weight e from a mixture and renormalizing changes it by at most e in
+    total variation distance."""
+    weights = view["weights"]
+    keep = weights >= threshold
+    keep[np.argmax(weights)] = True
+    dropped = float(weights[~keep].sum())
+    if dropped == 0:
+        return view, 0.0
+    distributions = [
+        dict(
+            dist,
+            params={
+                name: (
+                    [v for v, k in zip(values, keep) if k]
+                    if isinstance(values, list)
+                    else values[keep]
+                )
+                for name, values in dist["params"].items()
             },
-        }
-        for lw, z in zip(log_weights, tables)
+        )
+        for dist in view["distributions"]
     ]
-    return children_x
+    kept = weights[keep]
+    return {"weights": kept / kept.sum(), "distributions": distributions}, dropped
+
+
+def prune_views(views, threshold):
+    """Prune all views of a model (see `prune_view`). Returns the pruned views
+    and a report with the dropped weight per view and a bound on the total
+    variation error of the model: views are independent, so the error is at
+    most 1 - prod(1 - e) over the dropped weights e of the views."""
+    pruned = []
+    report = []
+    for view in views:
+        pruned_view, dropped = prune_view(view, threshold)
+        pruned.append(pruned_view)
+        report.append(
+            {
+                "clusters": len(view["weights"]),
+                "kept": len(pruned_view["weights"]),
+                "dropped_weight": dropped,
+            }
+        )
+    tv_bound = 1.0 - float(np.prod([1.0 - r["dropped_weight"] for r in report]))
+    return pruned, {"views": report, "tv_bound": tv_bound}
 
 
-def export_view(metadata, categorical_mapping, variable_mapping):
-    # Compute the CRP cluster weights using Zr and alpha.
-    Zr = metadata["Zr"]
-    alpha = metadata["alpha"]
-    counts = Counter(Zr)
-    tables_existing = sorted(set(Zr))
-    table_aux = max(tables_existing) + 1 if (len(tables_existing) > 0) else 0
-    tables = tables_existing + [table_aux]
-    weights = [counts[t] for t in tables_existing] + [alpha]
-    log_weights = math_util.lognorm([math.log(w) for w in weights])
-
-    products = export_cluster(
-        metadata, categorical_mapping, tables, log_weights, variable_mapping
-    )
+def param_lists(values):
+    """Return the per-cluster values of a parameter as Python lists. The rows
+    of "crp" columns differ in length, so they are converted one by one."""
+    if isinstance(values, list):
+        return [np.asarray(v).tolist() for v in values]
+    return np.asarray(values).tolist()
+
 
-    return products
+def view_clusters(view):
+    """Return the clusters of a view (see `export_view`) as multimixture AST
+    clusters, i.e. the value of :view/clusters."""
+    K = edn_format.Keyword
+    clusters = [
+        {K("cluster/weight"): weight, K("cluster/column->distribution"): {}}
+        for weight in view["weights"].tolist()
+    ]
+    for dist in view["distributions"]:
+        params = [
+            (K(name), param_lists(values)) for name, values in dist["params"].items()
+        ]
+        dist_type = K("distribution.type/" + dist["type"])
+        for i, cluster in enumerate(clusters):
+            primitive = {K("distribution/type"): dist_type}
+            for name, values in params:
+                value = values[i]
+                if isinstance(value, list):
+                    if dist["categories"] is None:
+                        keys = map(str, range(len(value)))
+                    else:
+                        keys = dist["categories"]
+                    value = dict(zip(keys, value))
+                primitive[name] = value
+            cluster[K("cluster/column->distribution")][dist["column"]] = primitive
+    return clusters
+
+
+def edn_number(x):
+    if math.isnan(x) or math.isinf(x):
+        return edn_format.dumps(x)
+    return repr(x)
+
+
+def write_edn(views, f):
+    """Write the multimixture AST of `views` (see `export_view`) as EDN, one
+    cluster per line, without building the AST in memory."""
+    strings = {}
+
+    def edn_string(s):
+        if s not in strings:
+            strings[s] = edn_format.dumps(s)
+        return strings[s]
+
+    f.write("{:multimixture/views [")
+    for view in views:
+        # Convert the parameters to lists of Python floats once per view.
+        distributions = [
+            (
+                edn_string(dist["column"]),
+                ":distribution.type/" + dist["type"],
+                [
+                    (":" + name, param_lists(values))
+                    for name, values in dist["params"].items()
+                ],
+                dist["categories"],
+            )
+            for dist in view["distributions"]
+        ]
+        f.write("\n {:view/clusters [")
+        for i, weight in enumerate(view["weights"].tolist()):
+            parts = ["\n  {:cluster/weight ", edn_number(weight)]
+            parts.append(" :cluster/column->distribution {")
+            for column, dist_type, params, categories in distributions:
+                parts.append(column)
+                parts.append(" {:distribution/type ")
+                parts.append(dist_type)
+                for name, values in params:
+                    parts.append(" ")
+                    parts.append(name)
+                    parts.append(" ")
+                    value = values[i]
+                    if isinstance(value, list):
+                        if categories is None:
+                            keys = map(str, range(len(value)))
+                        else:
+                            keys = categories
+                        parts.append("{")
+                        parts.append(
+                            " ".join(
+                                edn_string(key) + " " + edn_number(w)
+                                for key, w in zip(keys, value)
+                            )
+                        )
+                        parts.append("}")
+                    else:
+                        parts.append(edn_number(value))
+                parts.append("} ")
+            parts.append("}}")
+            f.write("".join(parts))
+        f.write("]}")
+    f.write("]}\n")
+
+
+def export_model(metadata, columns, mapping_table):
+    """Export all views of a model read with `read_metadata` (see
+    `export_view`)."""
+
+    def invert(d):
+        return {v: k for k, v in d.items()}
+
+    # Check if we ran streaming inference and cannot guarantee that the indexes
+    # in state.output agree with the column indeces in the traning data:
+    if "incorporated_cols" in metadata:
+        variable_mapping = dict(enumerate(metadata["incorporated_cols"]))
+    else:
+        variable_mapping = dict(enumerate(columns))
+    inv_variable_mapping = invert(variable_mapping)
+    category_mapping = {
+        inv_variable_mapping[k]: invert(v) for k, v in mapping_table.items()
+    }
+
+    views = []
+    view_partition = view_assignments_to_view_partition(metadata["Zv"])
+    for v, (view_idx, view_outputs) in enumerate(view_partition.items()):
+        metadata_view = {
+            "idx": v,
+            "outputs": view_outputs,
+            "cctypes": metadata["cctypes"],
+            "hypers": metadata["hypers"],
+            "distargs": metadata["distargs"],
+            "suffstats": metadata["suffstats"],
+            "Zr": metadata["Zrv"][view_idx],
+            "alpha": metadata["view_alphas"][view_idx],
+        }
+        views.append(export_view(metadata_view, category_mapping, variable_mapping))
+    return views
 
 
 def main():
@@ -268,9 +386,8 @@ def main():
 
     parser.add_argument(
         "--metadata",
-        type=argparse.FileType("r"),
-        help="Path to CGPM metadata.",
-        default=sys.stdin,
+        type=str,
+        help="Path to CGPM metadata (JSON or CGPM archive).",
     )
     parser.add_argument(
         "--data", type=argparse.FileType("r"), help="Path to numericalized CSV."
@@ -288,6 +405,21 @@ def main():
         help="Path to AST edn.",
         default=sys.stdout,
     )
+    parser.add_argument(
+        "--prune-threshold",
+        type=float,
+        default=None,
+        help="Drop clusters whose weight is below this threshold.",
+        metavar="WEIGHT",
+        dest="prune_threshold",
+    )
+    parser.add_argument(
+        "--prune-report",
+        type=argparse.FileType("w"),
+        default=sys.stderr,
+        help="Where to write the pruning report (JSON). Defaults to stderr.",
+        dest="prune_report",
+    )
 
     args = parser.parse_args()
 
@@ -295,43 +427,15 @@ def main():
         parser.print_help(sys.stderr)
         sys.exit(1)
 
-    def invert(d):
-        return {v: k for k, v in d.items()}
-
     metadata = read_metadata(args.metadata)
-    # Check if we ran streaming inference and cannot guarantee that the indexes
-    # in state.output agree with the column indeces in the traning data:
-    if "incorporated_cols" in metadata:
-        variable_mapping = dict(enumerate(metadata["incorporated_cols"]))
-    else:
-        variable_mapping = dict(enumerate(pd.read_csv(args.data)))
-    inv_variable_mapping = invert(variable_mapping)
-    mapping_table = edn_format.loads(args.mapping_table.read(), write_ply_tables=False)
-    category_mapping = {
-        inv_variable_mapping[k]: invert(v) for k, v in mapping_table.items()
-    }
-
-    outputs = metadata["outputs"]
-
-    views = []
-    view_partition = view_assignments_to_view_partition(metadata["Zv"])
-    for v, (view_idx, view_outputs) in enumerate(view_partition.items()):
-        metadata_view = {
-            "idx": v,
-            "outputs": view_outputs,
-            "cctypes": metadata["cctypes"],
-            "hypers": metadata["hypers"],
-            "distargs": metadata["distargs"],
-            "suffstats": metadata["suffstats"],
-            "Zr": metadata["Zrv"][view_idx],
-            "alpha": metadata["view_alphas"][view_idx],
-        }
-        view = export_view(metadata_view, category_mapping, variable_mapping)
-        views.append({edn_format.Keyword("view/clusters"): view})
-
-    args.output.write(
-        edn_format.dumps({edn_format.Keyword("multimixture/views"): views}, indent=4)
-    )
+    columns = pd.read_csv(args.data, nrows=0).columns
+    mapping_table = load_edn(args.mapping_table)
+    views = export_model(metadata, columns, mapping_table)
+    if args.prune_threshold is not None:
+        views, report = prune_views(views, args.prune_threshold)
+        json.dump(report, args.prune_report)
+        args.prune_report.write("\n")
+    write_edn(views, args.output)
 
 
 if __name__ == "__main__":
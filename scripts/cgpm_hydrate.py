@@ -2,12 +2,40 @@
 
 import argparse
 import cgpm.utils.general as general
-import edn_format
 import json
+import os
 import pandas
 import sys
 
 from cgpm.crosscat.state import State
+from cgpm_model import dump_json
+from cgpm_model import read_metadata
+from cgpm_model import write_metadata
+from edn_cache import load_edn
+
+
+def hydrate(base_metadata, additional_metadata, seed):
+    """Build a CGPM state from the metadata derived from the data and schema,
+    merged with additional metadata (e.g. a Loom sample's structure), and
+    return its metadata."""
+    metadata = {**base_metadata, **(additional_metadata or {})}
+    rng = general.gen_rng(seed)
+
+    if additional_metadata is not None:
+        state = State.from_metadata(metadata, rng=rng)
+    else:
+        state = State(**metadata, rng=rng)
+
+    return state.to_metadata()
+
+
+def read_lines(f):
+    """Yield the name and metadata of every sample in the JSON lines written by
+    `loom_dump.py --lines`."""
+    for line in f:
+        if line.strip():
+            sample = json.loads(line)
+            yield sample["name"], sample["metadata"]
 
 
 def main():
@@ -17,9 +45,9 @@ def main():
     parser.add_argument(
         "-o",
         "--output",
-        type=argparse.FileType("w+"),
-        help="Path to CGPM metadata.",
-        default=sys.stdout,
+        type=str,
+        help="Path to CGPM metadata. Written as a CGPM archive if it ends in .npz.",
+        default=None,
     )
     parser.add_argument(
         "--data", type=argparse.FileType("r"), help="Path to numericalized CSV."
@@ -33,8 +61,22 @@ def main():
         help="Path to Loom mapping table.",
         dest="mapping_table",
     )
+    parser.add_argument("--metadata", type=str, help="Path to input CGPM metadata.")
     parser.add_argument(
-        "--metadata", type=argparse.FileType("r"), help="Path to input CGPM metadata."
+        "--metadata-lines",
+        type=argparse.FileType("r"),
+        help=(
+            "Path to the JSON lines written by `loom_dump.py --lines` ('-' for "
+            "stdin). Every sample is hydrated and written to the --output directory."
+        ),
+        dest="metadata_lines",
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        choices=["json", "npz"],
+        default="json",
+        help="Format of the files written with --metadata-lines.",
     )
     parser.add_argument(
         "--model",
@@ -51,8 +93,8 @@ def main():
         sys.exit(1)
 
     df = pandas.read_csv(args.data)
-    schema = edn_format.loads(args.schema.read(), write_ply_tables=False)
-    mapping_table = edn_format.loads(args.mapping_table.read(), write_ply_tables=False)
+    schema = load_edn(args.schema)
+    mapping_table = load_edn(args.mapping_table)
 
     def n_categories(column):
         return len(mapping_table[column])
@@ -63,11 +105,6 @@ def main():
     cctypes = [schema[column] for column in df.columns]
     distargs = [distarg(column) for column in df.columns]
 
-    if args.metadata is not None:
-        additional_metadata = json.load(args.metadata)
-    else:
-        additional_metadata = {}
-
     base_metadata = dict(
         X=df.values, cctypes=cctypes, distargs=distargs, outputs=range(df.shape[1])
     )
@@ -82,15 +119,30 @@ def main():
     else:
         raise ValueError(f"Model '{args.model}' not definied")
 
-    metadata = {**base_metadata, **additional_metadata}
-    rng = general.gen_rng(args.seed)
+    if args.metadata_lines is not None:
+        # Hydrate all samples in this process so that the data and the schema
+        # are only read once. The i-th sample uses seed + i.
+        if args.output is None:
+            parser.error("--output must be a directory when using --metadata-lines.")
+        os.makedirs(args.output, exist_ok=True)
+        for i, (name, additional_metadata) in enumerate(
+            read_lines(args.metadata_lines)
+        ):
+            metadata = hydrate(base_metadata, additional_metadata, args.seed + i)
+            output = os.path.join(args.output, "{}.{}".format(name, args.format))
+            write_metadata(metadata, output)
+        return
 
     if args.metadata is not None:
-        state = State.from_metadata(metadata, rng=rng)
+        additional_metadata = read_metadata(args.metadata)
     else:
-        state = State(**metadata, rng=rng)
+        additional_metadata = None
 
-    json.dump(state.to_metadata(), args.output)
+    metadata = hydrate(base_metadata, additional_metadata, args.seed)
+    if args.output is None:
+        dump_json(metadata, sys.stdout)
+    else:
+        write_metadata(metadata, args.output)
 
 
 if __name__ == "__main__":
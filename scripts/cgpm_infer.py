@@ -2,21 +2,311 @@
 
 import argparse
 import cgpm.utils.general as general
+import hashlib
 import json
 import itertools
 import math
+import multiprocessing
+import numpy as np
+import os
 import pandas as pd
 import sys
+import time
 import yaml
 
 from cgpm.crosscat.state import State
+from cgpm_model import dump_json
+from cgpm_model import read_metadata
+from cgpm_model import write_metadata
 
 
-def replace(array, pred, replacement):
-    """Destructively replace all instances in a 2D array that satisfy a
-    predicate with a replacement.
-    """
-    return [[(y if not pred(y) else replacement) for y in x] for x in array]
+def metadata_paths(paths):
+    """Expand directories into the sorted list of files they contain. Paths to
+    files are kept as they are."""
+    result = []
+    for path in paths:
+        if os.path.isdir(path):
+            result.extend(
+                sorted(
+                    os.path.join(path, f)
+                    for f in os.listdir(path)
+                    if os.path.isfile(os.path.join(path, f))
+                )
+            )
+        else:
+            result.append(path)
+    return result
+
+
+def constraints(columns, cgpm_params):
+    """Translate the dependence and independence constraints in params.yaml
+    into CGPM column indices. This only depends on the data's columns, so it
+    is computed once and shared by all chains."""
+    # XXX: Constraining depedence only works if the columns are incorporated exactly as in the same
+    # order as in the data.
+    column_mapping = {c: i for i, c in enumerate(columns)}
+    dependence = [
+        (
+            column_mapping[target_column],
+            [column_mapping[column_to_move] for column_to_move in columns_to_move],
+        )
+        for target_column, columns_to_move in (
+            cgpm_params.get("dependence") or {}
+        ).items()
+    ]
+    # Indepdence is solved using CGPM's independence constraints.
+    Ci = [
+        tuple([column_mapping[c1], column_mapping[c2]])
+        for c1, cols in (cgpm_params.get("independence") or {}).items()
+        for c2 in cols
+    ]
+    return {"n_columns": len(columns), "dependence": dependence, "Ci": Ci}
+
+
+def apply_dependence(metadata, dependence):
+    """Move columns constrained to be dependent into their target column's
+    view. Returns the list of columns that must not be transitioned."""
+    do_not_transition = []
+    # We can't transition columns that are constrained to be dependent.
+    if dependence:
+        Zv = dict(metadata["Zv"])
+        for target_column, columns_to_move in dependence:
+            for column_to_move in columns_to_move:
+                Zv[column_to_move] = Zv[target_column]
+                do_not_transition.append(column_to_move)
+            do_not_transition.append(target_column)
+        metadata["Zv"] = Zv
+        # If we deleted a view all together, we need ensure that it's not around
+        # in Zrv anymore.
+        view_ids = list(Zv.values())
+        Zrv = dict(metadata["Zrv"])
+        for view_id in list(Zrv.keys()):
+            if not view_id in view_ids:
+                del Zrv[view_id]
+        metadata["Zrv"] = Zrv
+    return do_not_transition
+
+
+def file_hash(path):
+    """Hash a file's contents. Used to tell whether a checkpoint was written for
+    the same input metadata."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def encode_rng_state(rng):
+    name, keys, pos, has_gauss, cached_gaussian = rng.get_state()
+    return [name, keys.tolist(), pos, has_gauss, cached_gaussian]
+
+
+def decode_rng_state(rng_state):
+    name, keys, pos, has_gauss, cached_gaussian = rng_state
+    return (name, np.asarray(keys, dtype=np.uint32), pos, has_gauss, cached_gaussian)
+
+
+def save_checkpoint(path, state, progress, key):
+    """Atomically write the state's metadata, the position in the inference
+    program and the state of the random number generator to disk."""
+    metadata = state.to_metadata()
+    metadata["checkpoint"] = {
+        "key": key,
+        "progress": progress,
+        "rng_state": encode_rng_state(state.rng),
+    }
+    root, extension = os.path.splitext(path)
+    tmp_path = root + ".tmp" + extension
+    write_metadata(metadata, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path, key):
+    """Read a checkpoint written by `save_checkpoint`. Returns the state's
+    metadata and the checkpoint information, or None if there is no checkpoint
+    or if it was written for different input metadata."""
+    if not os.path.exists(path):
+        return None
+    metadata = read_metadata(path)
+    checkpoint = metadata.pop("checkpoint")
+    if checkpoint["key"] != key:
+        return None
+    return metadata, checkpoint
+
+
+def diagnostics(state):
+    """Cheap summaries of a state that are recorded after every sweep."""
+    return {
+        "logscore": state.logpdf_score(),
+        "views": len(state.views),
+        "alpha": state.alpha(),
+        "view_alphas": [view.alpha() for view in state.views.values()],
+    }
+
+
+def converged(trace, window, tolerance):
+    """Whether the joint log score has reached a plateau, i.e. whether its mean
+    over the last `window` sweeps differs from its mean over the `window`
+    sweeps before that by at most `tolerance` (relative)."""
+    if len(trace) < 2 * window:
+        return False
+    logscores = [d["logscore"] for d in trace[-2 * window :]]
+    previous = np.mean(logscores[:window])
+    current = np.mean(logscores[window:])
+    return abs(current - previous) <= tolerance * abs(previous)
+
+
+def infer(
+    metadata,
+    seed,
+    constraints,
+    kernels,
+    iterations=None,
+    minutes=None,
+    checkpoint_path=None,
+    checkpoint_minutes=5,
+    resume=False,
+    key=None,
+    convergence=None,
+    trace=False,
+):
+    """Run inference on a single chain starting from hydrated CGPM metadata.
+    Returns the resulting state's metadata and the per-sweep diagnostics trace
+    (None unless `trace` or `convergence` is set).
+
+    If `checkpoint_path` is set, the state is written to `checkpoint_path`
+    every `checkpoint_minutes`. With `resume`, inference continues from that
+    checkpoint -- with the same random number stream -- if it was written for
+    the same `key`.
+
+    If `convergence` is set to a dict with a `window` and a `tolerance`,
+    inference stops early once the joint log score has converged (see
+    `converged`). `iterations` and `minutes` remain upper bounds."""
+    progress = {"fixed": False, "iterations": 0, "seconds": 0.0, "converged": False}
+    checkpoint = None
+    if resume and checkpoint_path is not None:
+        checkpoint = load_checkpoint(checkpoint_path, key)
+    if checkpoint is not None:
+        metadata, checkpoint = checkpoint
+        progress = checkpoint["progress"]
+
+    do_not_transition = apply_dependence(metadata, constraints["dependence"])
+    columns_transition = [
+        i for i in range(constraints["n_columns"]) if i not in do_not_transition
+    ]
+    metadata["Ci"] = list(constraints["Ci"])
+    rng = general.gen_rng(seed)
+    state = State.from_metadata(metadata, rng=rng)
+    if checkpoint is not None:
+        rng.set_state(decode_rng_state(checkpoint["rng_state"]))
+
+    if do_not_transition and not progress["fixed"]:
+        # Update hyper-parameters for columns you want to fix.
+        state.transition(
+            N=30, kernels=["column_hypers"], cols=do_not_transition, progress=False
+        )
+    progress["fixed"] = True
+
+    record_trace = trace or convergence is not None
+    if record_trace:
+        progress.setdefault("trace", [])
+
+    if checkpoint_path is None and not record_trace:
+        if iterations is not None:
+            state.transition(N=iterations, kernels=kernels, cols=columns_transition)
+        if minutes is not None:
+            state.transition(S=minutes * 60, kernels=kernels, cols=columns_transition)
+    else:
+        # Run inference one sweep at a time so we can record diagnostics, stop
+        # early and write checkpoints in between sweeps.
+        last_checkpoint = time.time()
+
+        def after_sweep():
+            nonlocal last_checkpoint
+            if record_trace:
+                progress["trace"].append(diagnostics(state))
+            if convergence is not None:
+                progress["converged"] = converged(progress["trace"], **convergence)
+            if (
+                checkpoint_path is not None
+                and time.time() - last_checkpoint >= checkpoint_minutes * 60
+            ):
+                save_checkpoint(checkpoint_path, state, progress, key)
+                last_checkpoint = time.time()
+
+        while (
+            iterations is not None
+            and progress["iterations"] < iterations
+            and not progress["converged"]
+        ):
+            state.transition(
+                N=1, kernels=kernels, cols=columns_transition, progress=False
+            )
+            progress["iterations"] += 1
+            after_sweep()
+        while (
+            minutes is not None
+            and progress["seconds"] < minutes * 60
+            and not progress["converged"]
+        ):
+            start = time.time()
+            state.transition(
+                N=1, kernels=kernels, cols=columns_transition, progress=False
+            )
+            progress["seconds"] += time.time() - start
+            after_sweep()
+
+    if do_not_transition:
+        # Update hyper-parameters once more for columns kept fixed.
+        state.transition(
+            N=10, kernels=["column_hypers"], cols=do_not_transition, progress=False
+        )
+
+    return state.to_metadata(), progress.get("trace")
+
+
+# Settings shared by all chains run in a worker process. These are set once per
+# worker by `init_worker` so that they don't have to be sent with every chain.
+_worker_settings = {}
+
+
+def init_worker(settings):
+    _worker_settings.update(settings)
+
+
+def run_chain(path, output_path, seed, checkpoint_dir=None, trace_dir=None, **settings):
+    """Run a single chain and write its metadata to `output_path` (or stdout)
+    as soon as it's done. If `trace_dir` is set, the chain's diagnostics trace
+    is written there under the same file name as the input."""
+    metadata = read_metadata(path)
+    checkpoint_path = None
+    if checkpoint_dir is not None:
+        checkpoint_path = os.path.join(checkpoint_dir, os.path.basename(path))
+        settings["key"] = "{}-{}".format(file_hash(path), seed)
+    state_metadata, trace = infer(
+        metadata,
+        seed,
+        checkpoint_path=checkpoint_path,
+        trace=trace_dir is not None,
+        **settings,
+    )
+    if output_path is None:
+        dump_json(state_metadata, sys.stdout)
+    else:
+        write_metadata(state_metadata, output_path)
+    if trace_dir is not None:
+        with open(os.path.join(trace_dir, os.path.basename(path)), "w") as f:
+            json.dump(trace, f)
+    # The chain is complete, so there is nothing left to resume.
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return output_path
+
+
+def infer_chain(job):
+    path, output_path, seed = job
+    return run_chain(path, output_path, seed, **_worker_settings)
 
 
 def main():
@@ -24,16 +314,17 @@ def main():
 
     parser.add_argument(
         "metadata",
-        type=argparse.FileType("r"),
-        help="CGPM metadata JSON",
-        default=sys.stdin,
+        type=str,
+        nargs="+",
+        help="CGPM metadata JSON, or a directory of CGPM metadata JSON files.",
         metavar="PATH",
     )
     parser.add_argument(
         "-o",
         "--output",
-        type=argparse.FileType("w+"),
-        default=sys.stdout,
+        type=str,
+        help="Path to write metadata to. Must be a directory when running more than one chain.",
+        default=None,
         metavar="PATH",
     )
     parser.add_argument(
@@ -66,76 +357,97 @@ def main():
     parser.add_argument(
         "--params", type=argparse.FileType("r"), help="Path to params.yaml"
     )
-    parser.add_argument("--seed", type=int, default=1, help="CGPM seed.")
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=1,
+        help="CGPM seed. When running multiple chains the i-th chain (in sorted order) uses seed + i.",
+    )
+    parser.add_argument(
+        "--checkpoint-dir",
+        type=str,
+        help="Directory to periodically checkpoint chains to. Defaults to `cgpm.checkpoint_dir` in params.yaml; chains aren't checkpointed if neither is set.",
+        default=None,
+        metavar="PATH",
+        dest="checkpoint_dir",
+    )
+    parser.add_argument(
+        "--checkpoint-minutes",
+        type=float,
+        help="Minutes between checkpoints. Defaults to `cgpm.checkpoint_minutes` in params.yaml or 5.",
+        default=None,
+        metavar="NUM",
+        dest="checkpoint_minutes",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume chains from their checkpoints in --checkpoint-dir, if any.",
+    )
+    parser.add_argument(
+        "--trace-dir",
+        type=str,
+        help="Directory to write each chain's per-sweep diagnostics trace to. Defaults to `cgpm.trace_dir` in params.yaml; no traces are written if neither is set.",
+        default=None,
+        metavar="PATH",
+        dest="trace_dir",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes. Defaults to `cgpm.workers` in params.yaml or the number of CPUs.",
+        metavar="NUM",
+    )
 
     args = parser.parse_args()
 
-    if args.metadata is None:
+    paths = metadata_paths(args.metadata)
+    if not paths:
         parser.print_help(sys.stderr)
         sys.exit(1)
 
-    metadata = json.load(args.metadata)
-    metadata["X"] = replace(metadata["X"], lambda x: x is None, math.nan)
-
-    # XXX: Constraining depedence only works if the columns are incorporated exactly as in the same
-    # order as in the data.
-    df = pd.read_csv(args.data)
-    column_mapping = {c: i for i, c in enumerate(df.columns)}
+    # Only the header of the data is needed to resolve column constraints.
+    columns = pd.read_csv(args.data, nrows=0).columns
     cgpm_params = yaml.safe_load(args.params)["cgpm"]
-    do_not_transition = []
+    settings = dict(
+        constraints=constraints(columns, cgpm_params),
+        kernels=args.kernels,
+        iterations=args.iterations,
+        minutes=args.minutes,
+        # Checkpoints and traces are opt-in: they make inference run one sweep
+        # at a time.
+        checkpoint_dir=args.checkpoint_dir or cgpm_params.get("checkpoint_dir"),
+        checkpoint_minutes=(
+            args.checkpoint_minutes or cgpm_params.get("checkpoint_minutes") or 5
+        ),
+        resume=args.resume,
+        convergence=cgpm_params.get("convergence"),
+        trace_dir=args.trace_dir or cgpm_params.get("trace_dir"),
+    )
+    for directory in [settings["checkpoint_dir"], settings["trace_dir"]]:
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
 
-    # We can't transition columns that are constrained to be dependent.
-    if "dependence" in cgpm_params:
-        Zv = dict(metadata["Zv"])
-        for target_column, columns_to_move in cgpm_params["dependence"].items():
-            for column_to_move in columns_to_move:
-                Zv[column_mapping[column_to_move]] = Zv[column_mapping[target_column]]
-                do_not_transition.append(column_mapping[column_to_move])
-            do_not_transition.append(column_mapping[target_column])
-        metadata["Zv"] = Zv
-        # If we deleted a view all together, we need ensure that it's not around
-        # in Zrv anymore.
-        view_ids = list(Zv.values())
-        Zrv = dict(metadata["Zrv"])
-        for view_id in list(Zrv.keys()):
-            if not view_id in view_ids:
-                del Zrv[view_id]
-        metadata["Zrv"] = Zrv
-    columns_transition = [i for i in range(df.shape[1]) if i not in do_not_transition]
-    rng = general.gen_rng(args.seed)
-    # Indepdence is solved using CGPM's independence constraints.
-    if "independence" in cgpm_params:
-        Ci = []
-        for c1, cols in cgpm_params["independence"].items():
-            for c2 in cols:
-                Ci.append(tuple([column_mapping[c1], column_mapping[c2]]))
-    else:
-        Ci = []
-    metadata["Ci"] = Ci
-    state = State.from_metadata(metadata, rng=rng)
+    if len(paths) == 1 and (args.output is None or not os.path.isdir(args.output)):
+        run_chain(paths[0], args.output, args.seed, **settings)
+        return
 
-    if do_not_transition:
-        # Update hyper-parameters for columns you want to fix.
-        state.transition(
-            N=30, kernels=["column_hypers"], cols=do_not_transition, progress=False
-        )
-    if args.iterations is not None:
-        state.transition(
-            N=args.iterations, kernels=args.kernels, cols=columns_transition
-        )
-    if args.minutes is not None:
-        state.transition(
-            S=args.minutes * 60, kernels=args.kernels, cols=columns_transition
-        )
-    if do_not_transition:
-        # Update hyper-parameters once more for columns kept fixed.
-        state.transition(
-            N=10, kernels=["column_hypers"], cols=do_not_transition, progress=False
-        )
+    if args.output is None or not os.path.isdir(args.output):
+        parser.error("--output must be an existing directory for multiple chains.")
 
-    state_metadata = state.to_metadata()
-    state_metadata["X"] = replace(state_metadata["X"], math.isnan, None)
-    json.dump(state_metadata, args.output)
+    workers = args.workers or cgpm_params.get("workers") or os.cpu_count()
+    jobs = [
+        (path, os.path.join(args.output, os.path.basename(path)), args.seed + i)
+        for i, path in enumerate(paths)
+    ]
+    with multiprocessing.Pool(
+        processes=min(workers, len(jobs)),
+        initializer=init_worker,
+        initargs=(settings,),
+    ) as pool:
+        for output_path in pool.imap_unordered(infer_chain, jobs):
+            print(output_path, file=sys.stderr)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,99 @@
+import json
+import math
+import numpy as np
+import zipfile
+
+# CGPM state metadata can be stored either as JSON or as a CGPM archive. A CGPM
+# archive is an uncompressed zip file holding a JSON header with all the
+# metadata except for the data matrix and the row-cluster assignments, which
+# are stored as typed NumPy arrays:
+#
+#   header.json  -- all other metadata plus `n_rows` and `Zrv_views`
+#   X.npy        -- float64 data matrix (rows x columns), NaN for missing
+#   Zrv.npy      -- int32 row-cluster assignments (views x rows), where row k
+#                   holds the assignments of the view `Zrv_views[k]`
+ARCHIVE_EXTENSION = ".npz"
+ARRAYS = ("X", "Zrv")
+
+
+def replace(array, pred, replacement):
+    """Destructively replace all instances in a 2D array that satisfy a
+    predicate with a replacement.
+    """
+    return [[(y if not pred(y) else replacement) for y in x] for x in array]
+
+
+def is_archive(path):
+    return str(path).endswith(ARCHIVE_EXTENSION)
+
+
+def dump_json(metadata, f):
+    """Write metadata as JSON, representing missing values in X as null."""
+    if "X" in metadata:
+        metadata = {**metadata, "X": replace(metadata["X"], math.isnan, None)}
+    json.dump(metadata, f)
+
+
+def load_json(f, arrays=ARRAYS):
+    metadata = json.load(f)
+    for name in ARRAYS:
+        if name not in arrays:
+            metadata.pop(name, None)
+    if "X" in metadata:
+        metadata["X"] = replace(metadata["X"], lambda x: x is None, math.nan)
+    return metadata
+
+
+def write_archive(metadata, path):
+    header = {k: v for k, v in metadata.items() if k not in ARRAYS}
+    arrays = {}
+    if "X" in metadata:
+        arrays["X"] = np.asarray(metadata["X"], dtype=np.float64)
+        header["n_rows"] = arrays["X"].shape[0]
+    if "Zrv" in metadata:
+        Zrv = metadata["Zrv"]
+        Zrv = list(Zrv.items()) if isinstance(Zrv, dict) else list(Zrv)
+        header["Zrv_views"] = [v for v, _ in Zrv]
+        arrays["Zrv"] = np.asarray([Zr for _, Zr in Zrv], dtype=np.int32)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+        archive.writestr("header.json", json.dumps(header))
+        for name, array in arrays.items():
+            with archive.open(name + ".npy", "w", force_zip64=True) as f:
+                np.lib.format.write_array(f, array, allow_pickle=False)
+
+
+def read_archive(path, arrays=ARRAYS):
+    with zipfile.ZipFile(path, "r") as archive:
+        metadata = json.loads(archive.read("header.json"))
+        members = set(archive.namelist())
+        loaded = {}
+        for name in arrays:
+            if name + ".npy" in members:
+                with archive.open(name + ".npy", "r") as f:
+                    loaded[name] = np.lib.format.read_array(f, allow_pickle=False)
+    if "X" in loaded:
+        metadata["X"] = loaded["X"]
+    views = metadata.pop("Zrv_views", None)
+    if "Zrv" in loaded:
+        metadata["Zrv"] = [[v, Zr.tolist()] for v, Zr in zip(views, loaded["Zrv"])]
+    return metadata
+
+
+def write_metadata(metadata, path):
+    """Write CGPM state metadata to `path`. The format is chosen by the file
+    extension: CGPM archive for `.npz`, JSON otherwise."""
+    if is_archive(path):
+        write_archive(metadata, path)
+    else:
+        with open(path, "w") as f:
+            dump_json(metadata, f)
+
+
+def read_metadata(path, arrays=ARRAYS):
+    """Read CGPM state metadata written by `write_metadata`. Missing values in
+    X are NaN. Only the arrays named in `arrays` are read, so callers that don't
+    need the data matrix or the row-cluster assignments can skip them."""
+    if is_archive(path):
+        return read_archive(path, arrays=arrays)
+    with open(path, "r") as f:
+        return load_json(f, arrays=arrays)
@@ -2,7 +2,6 @@
 
 import argparse
 import cgpm.utils.general as general
-import edn_format
 import itertools
 import json
 import math
@@ -11,9 +10,14 @@ import pandas as pd
 import sys
 from inf_prog import inf_prog
 from inf_prog import init_stream
+from smc import smc
 
 from stream_cat import Streamcat
-from cgpm_infer import replace
+from stream_summary import SummaryHook
+from stream_summary import open_sink
+from cgpm_model import write_metadata
+from checkpoint_writer import CheckpointWriter
+from edn_cache import load_edn
 
 
 def main():
@@ -38,12 +42,88 @@ def main():
         dest="mapping_table",
     )
     parser.add_argument("--seed", type=int, default=1, help="CGPM seed.")
+    parser.add_argument(
+        "--block-size",
+        type=int,
+        default=1,
+        help="Number of rows incorporated between row transitions.",
+        metavar="NUM",
+        dest="block_size",
+    )
+    parser.add_argument(
+        "--particles",
+        type=int,
+        default=None,
+        help="Run sequential Monte Carlo with this many particles. The samples are written to the directory --output.",
+        metavar="NUM",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes for the particles. Defaults to the number of CPUs.",
+        metavar="NUM",
+    )
+    parser.add_argument(
+        "--ess-threshold",
+        type=float,
+        default=0.5,
+        help="Resample when the effective sample size drops below this fraction of the particles.",
+        metavar="FRACTION",
+        dest="ess_threshold",
+    )
+    parser.add_argument(
+        "--rejuvenation",
+        type=int,
+        default=1,
+        help="Number of transitions run on every particle after resampling.",
+        metavar="NUM",
+    )
+    parser.add_argument(
+        "--checkpoint-every",
+        type=int,
+        default=50,
+        help="Number of rows between checkpoints.",
+        metavar="NUM",
+        dest="checkpoint_every",
+    )
+    parser.add_argument(
+        "--checkpoint-queue",
+        type=int,
+        default=4,
+        help="Maximum number of checkpoints waiting to be written in the background before inference waits for the writer.",
+        metavar="NUM",
+        dest="checkpoint_queue",
+    )
+    parser.add_argument(
+        "--summary",
+        type=str,
+        default=None,
+        help="Append a JSON line summarizing the chain to this file, or send it to a local socket (HOST:PORT or unix:PATH).",
+        metavar="TARGET",
+    )
+    parser.add_argument(
+        "--summary-every",
+        type=int,
+        default=10,
+        help="Number of rows between summaries.",
+        metavar="NUM",
+        dest="summary_every",
+    )
+    parser.add_argument(
+        "--checkpoint-format",
+        type=str,
+        choices=["json", "npz", "ckpt"],
+        default="json",
+        help="Format of the checkpoints written during inference. With ckpt, all checkpoints of a chain are appended to one checkpoint archive.",
+        dest="checkpoint_format",
+    )
 
     args = parser.parse_args()
 
     df = pd.read_csv(args.data)
-    schema = edn_format.loads(args.schema.read(), write_ply_tables=False)
-    mapping_table = edn_format.loads(args.mapping_table.read(), write_ply_tables=False)
+    schema = load_edn(args.schema)
+    mapping_table = load_edn(args.mapping_table)
 
     def n_categories(column):
         return len(mapping_table[column])
@@ -63,15 +143,46 @@ def main():
         cctypes_orig_order=cctypes,
         distargs_orig_order=distargs,
         seed=args.seed,
+        checkpoint_format=args.checkpoint_format,
     )
 
+    if args.particles is not None:
+        # Particles don't write checkpoints.
+        samples = smc(
+            metadata,
+            args.particles,
+            args.seed,
+            workers=args.workers,
+            block_size=args.block_size,
+            ess_threshold=args.ess_threshold,
+            rejuvenation=args.rejuvenation,
+        )
+        os.makedirs(args.output, exist_ok=True)
+        extension = "npz" if args.checkpoint_format == "npz" else "json"
+        for i, sample in enumerate(samples):
+            path = os.path.join(
+                args.output, "sample.{}.{}".format(args.seed + i, extension)
+            )
+            write_metadata(sample, path)
+        return
+
+    hooks = []
+    if args.summary is not None:
+        sink = open_sink(args.summary)
+        hooks.append(SummaryHook(sink, every=args.summary_every))
+
     model = Streamcat.from_metadata(metadata)
-    model = inf_prog(model)
-    model_metadata = model.to_metadata()
-    # Ensure we save the correct x corresponding to the correct values in
-    # output.
-    model_metadata["X"] = replace(model_metadata["X"], math.isnan, None)
-    json.dump(model_metadata, open(args.output, "w"))
+    with CheckpointWriter(max_pending=args.checkpoint_queue) as writer:
+        model.checkpoint_writer = writer
+        model = inf_prog(
+            model,
+            block_size=args.block_size,
+            checkpoint_every=args.checkpoint_every,
+            hooks=hooks,
+        )
+    if args.summary is not None:
+        sink.close()
+    write_metadata(model.to_metadata(), args.output)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import os
+import pandas as pd
+import sppl.compilers.spe_to_dict as spe_to_dict
+import sys
+
+from ast_export import export_model
+from ast_export import prune_views
+from ast_export import read_metadata
+from ast_export import view_clusters
+from ast_export import write_edn
+from edn_cache import load_edn
+from sppl_import import convert_model
+from sppl_import import convert_view
+
+# Compiles an ensemble of CGPM models into SPPL in one process, without the
+# round trip through EDN that `ast_export.py` and `sppl_import.py` take. The
+# maximum number of views across the ensemble, which every model is padded to
+# so that the models can be merged, is computed along the way.
+
+
+def name(path):
+    """Return the file name of a model without its extension."""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def main():
+    description = "Compiles CGPM models into SPPL."
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        nargs="+",
+        type=str,
+        help="CGPM model JSON files or CGPM archives.",
+        metavar="MODEL",
+        dest="models",
+    )
+    parser.add_argument(
+        "--data", type=argparse.FileType("r"), help="Path to numericalized CSV."
+    )
+    parser.add_argument(
+        "--mapping-table",
+        type=argparse.FileType("r"),
+        help="Path to categorical mapping table.",
+        dest="mapping_table",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        help="Directory for the SPPL JSON of every model.",
+        metavar="DIR",
+    )
+    parser.add_argument(
+        "--ast",
+        type=str,
+        default=None,
+        help="Also write the multimixture AST EDN of every model to this directory.",
+        metavar="DIR",
+    )
+    parser.add_argument(
+        "--prune-threshold",
+        type=float,
+        default=None,
+        help="Drop clusters whose weight is below this threshold.",
+        metavar="WEIGHT",
+        dest="prune_threshold",
+    )
+    parser.add_argument(
+        "--prune-report",
+        type=argparse.FileType("w"),
+        default=sys.stderr,
+        help="Where to write the pruning report (JSON). Defaults to stderr.",
+        dest="prune_report",
+    )
+    parser.add_argument(
+        "--max-number-views",
+        type=argparse.FileType("w"),
+        default=None,
+        help="Also write the maximum number of views to this file.",
+        dest="max_number_views",
+    )
+    args = parser.parse_args()
+
+    if any(x is None for x in [args.data, args.mapping_table, args.output]):
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+
+    columns = pd.read_csv(args.data, nrows=0).columns
+    mapping_table = load_edn(args.mapping_table)
+
+    # Only the exported views of each model, which are much smaller than the
+    # model, are kept until the maximum number of views is known.
+    models = []
+    reports = {}
+    for path in args.models:
+        views = export_model(read_metadata(path), columns, mapping_table)
+        if args.prune_threshold is not None:
+            views, reports[name(path)] = prune_views(views, args.prune_threshold)
+        models.append((name(path), views))
+        if args.ast is not None:
+            with open(os.path.join(args.ast, name(path) + ".edn"), "w") as f:
+                write_edn(views, f)
+    max_number_of_views = max(len(views) for _, views in models)
+    if args.prune_threshold is not None:
+        # The ensemble is an equally weighted mixture of the models.
+        tv_bound = sum(r["tv_bound"] for r in reports.values()) / len(reports)
+        json.dump({"models": reports, "tv_bound": tv_bound}, args.prune_report)
+        args.prune_report.write("\n")
+    if args.max_number_views is not None:
+        args.max_number_views.write(str(max_number_of_views))
+
+    for model_name, views in models:
+        spe = convert_model(
+            [
+                convert_view(view_index, view_clusters(view))
+                for view_index, view in enumerate(views)
+            ],
+            max_number_of_views,
+        )
+        with open(os.path.join(args.output, model_name + ".json"), "w") as f:
+            json.dump(spe_to_dict.spe_to_dict(spe), f)
+
+
+if __name__ == "__main__":
+    main()
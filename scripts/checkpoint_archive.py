@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import math
+import numpy as np
+import os
+import struct
+import sys
+import zlib
+
+from cgpm_model import ARRAYS
+from cgpm_model import dump_json
+from cgpm_model import replace
+
+# A checkpoint archive holds the sequence of checkpoints of one streaming chain
+# in a single append-only file:
+#
+#   header   -- MAGIC, format version and the keyframe interval
+#   records  -- one record per checkpoint: kind (KEYFRAME or DELTA), payload
+#               length and the zlib-compressed JSON payload
+#   index    -- the offsets of all records as uint64, followed by a footer with
+#               the offset of the index, the number of records and INDEX_MAGIC
+#
+# Every `keyframe_every`-th checkpoint is stored in full. All other checkpoints
+# are stored as deltas against the previous checkpoint: the top-level keys that
+# changed, the rows appended to X and, for every view, the changed and appended
+# row-cluster assignments. Checkpoint i is materialized by reading the keyframe
+# before it and applying at most `keyframe_every - 1` deltas, so random access
+# costs O(keyframe_every) records. Iterating over the archive applies one delta
+# per checkpoint, and so does indexing the checkpoints in increasing order,
+# which resumes from the last checkpoint materialized. Smaller intervals make
+# random access cheaper at the cost of a larger archive.
+#
+# The index is written when the archive is closed. If a writer is killed before
+# that, readers recover the index by scanning the records.
+EXTENSION = ".ckpt"
+MAGIC = b"CGPMCKPT"
+VERSION = 1
+INDEX_MAGIC = b"CKPTINDX"
+HEADER = struct.Struct("<8sBI")
+RECORD = struct.Struct("<BI")
+FOOTER = struct.Struct("<QQ8s")
+KEYFRAME = 0
+DELTA = 1
+KEYFRAME_EVERY = 20
+
+
+def is_checkpoint_archive(path):
+    return str(path).endswith(EXTENSION)
+
+
+def plain(value):
+    """Return `value` as the plain values it is read back as from JSON: arrays
+    and tuples as lists, NumPy scalars as Python numbers and dict keys as
+    strings."""
+    if isinstance(value, dict):
+        return {
+            k if isinstance(k, str) else json.dumps(plain(k)): plain(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [plain(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def normalize(metadata):
+    """Return `metadata` as plain JSON values with missing values in X as None,
+    so that checkpoints can be compared with ==."""
+    metadata = plain(metadata)
+    if "X" in metadata:
+        metadata["X"] = replace(metadata["X"], math.isnan, None)
+    return metadata
+
+
+def encode_delta(previous, current):
+    delta = {
+        "set": {},
+        "removed": [k for k in previous if k not in current],
+    }
+    for k, v in current.items():
+        if k in ("X", "Zrv") or (k in previous and previous[k] == v):
+            continue
+        delta["set"][k] = v
+
+    if "X" in current:
+        X, previous_X = current["X"], previous.get("X")
+        n = -1 if previous_X is None else len(previous_X)
+        if 0 <= n <= len(X) and X[:n] == previous_X:
+            delta["X_rows"] = X[n:]
+        else:
+            delta["set"]["X"] = X
+
+    if "Zrv" in current:
+        previous_Zrv = dict(previous.get("Zrv", []))
+        entries = []
+        for v, Zr in current["Zrv"]:
+            previous_Zr = previous_Zrv.get(v)
+            if previous_Zr is None or len(previous_Zr) > len(Zr):
+                entries.append([v, Zr])
+                continue
+            n = len(previous_Zr)
+            changed = np.flatnonzero(np.asarray(Zr[:n]) != np.asarray(previous_Zr))
+            changed = changed.tolist()
+            entries.append([v, changed, [Zr[i] for i in changed], Zr[n:]])
+        delta["Zrv"] = entries
+    return delta
+
+
+def apply_delta(previous, delta):
+    current = {k: v for k, v in previous.items() if k not in delta["removed"]}
+    current.update(delta["set"])
+    if "X_rows" in delta:
+        current["X"] = previous["X"] + delta["X_rows"]
+    if "Zrv" in delta:
+        previous_Zrv = dict(previous.get("Zrv", []))
+        Zrv = []
+        for entry in delta["Zrv"]:
+            if len(entry) == 2:
+                Zrv.append(entry)
+                continue
+            v, changed, values, appended = entry
+            Zr = list(previous_Zrv[v])
+            for i, z in zip(changed, values):
+                Zr[i] = z
+            Zrv.append([v, Zr + appended])
+        current["Zrv"] = Zrv
+    return current
+
+
+class ArchiveWriter:
+    """Write the checkpoints of one chain to a new checkpoint archive."""
+
+    def __init__(self, path, keyframe_every=KEYFRAME_EVERY):
+        self.keyframe_every = keyframe_every
+        self.offsets = []
+        self.previous = None
+        self.f = open(path, "wb")
+        self.f.write(HEADER.pack(MAGIC, VERSION, keyframe_every))
+
+    def append(self, metadata):
+        current = normalize(metadata)
+        if len(self.offsets) % self.keyframe_every == 0:
+            kind, payload = KEYFRAME, current
+        else:
+            kind, payload = DELTA, encode_delta(self.previous, current)
+        data = zlib.compress(json.dumps(payload).encode("utf-8"))
+        self.offsets.append(self.f.tell())
+        self.f.write(RECORD.pack(kind, len(data)))
+        self.f.write(data)
+        self.f.flush()
+        self.previous = current
+
+    def close(self):
+        index_offset = self.f.tell()
+        self.f.write(np.asarray(self.offsets, dtype="<u8").tobytes())
+        self.f.write(FOOTER.pack(index_offset, len(self.offsets), INDEX_MAGIC))
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CheckpointArchive:
+    """Read a checkpoint archive. Checkpoints are materialized lazily, either
+    by index (`archive[i]`, which replays up to `keyframe_every - 1` deltas)
+    or in order by iterating over the archive."""
+
+    def __init__(self, path, arrays=ARRAYS):
+        self.arrays = arrays
+        self.f = open(path, "rb")
+        magic, version, self.keyframe_every = HEADER.unpack(self.f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a checkpoint archive: {}".format(path))
+        self.offsets = self.read_index()
+        self.last = None
+
+    def read_index(self):
+        size = os.fstat(self.f.fileno()).st_size
+        if size >= HEADER.size + FOOTER.size:
+            self.f.seek(size - FOOTER.size)
+            index_offset, count, magic = FOOTER.unpack(self.f.read(FOOTER.size))
+            if magic == INDEX_MAGIC and index_offset + 8 * count + FOOTER.size == size:
+                self.f.seek(index_offset)
+                return np.frombuffer(self.f.read(8 * count), dtype="<u8").tolist()
+        # No index, the writer didn't finish. Scan the complete records.
+        offsets = []
+        offset = HEADER.size
+        while offset + RECORD.size <= size:
+            self.f.seek(offset)
+            kind, length = RECORD.unpack(self.f.read(RECORD.size))
+            if kind not in (KEYFRAME, DELTA) or offset + RECORD.size + length > size:
+                break
+            offsets.append(offset)
+            offset += RECORD.size + length
+        return offsets
+
+    def record(self, i):
+        self.f.seek(self.offsets[i])
+        kind, length = RECORD.unpack(self.f.read(RECORD.size))
+        return kind, json.loads(zlib.decompress(self.f.read(length)))
+
+    def materialize(self, state):
+        """Return a checkpoint in the format of `cgpm_model.read_metadata`."""
+        state = {k: v for k, v in state.items() if k not in ARRAYS or k in self.arrays}
+        if "X" in state:
+            state["X"] = replace(state["X"], lambda x: x is None, math.nan)
+        return state
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        start = i - i % self.keyframe_every
+        if self.last is not None and start <= self.last[0] <= i:
+            start, state = self.last
+        else:
+            kind, state = self.record(start)
+            assert kind == KEYFRAME
+        for j in range(start + 1, i + 1):
+            state = apply_delta(state, self.record(j)[1])
+        self.last = (i, state)
+        return self.materialize(state)
+
+    def __iter__(self):
+        state = None
+        for i in range(len(self)):
+            kind, payload = self.record(i)
+            state = payload if kind == KEYFRAME else apply_delta(state, payload)
+            yield self.materialize(state)
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main():
+    description = "Writes the checkpoints in a checkpoint archive as a JSON array."
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("archive", type=str, help="Path to checkpoint archive.")
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=argparse.FileType("w"),
+        help="Path to JSON output.",
+        default=sys.stdout,
+    )
+    args = parser.parse_args()
+
+    # Write one checkpoint at a time instead of building the whole array.
+    with CheckpointArchive(args.archive) as archive:
+        args.output.write("[")
+        for i, metadata in enumerate(archive):
+            if i > 0:
+                args.output.write(",")
+            dump_json(metadata, args.output)
+        args.output.write("]\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import os
+import queue
+import threading
+
+from checkpoint_archive import ArchiveWriter
+from checkpoint_archive import is_checkpoint_archive
+from cgpm_model import write_metadata
+
+# Writing a checkpoint of a CGPM state serializes the whole state, including
+# the data matrix. `CheckpointWriter` moves the serialization and the disk I/O
+# to a background thread so that inference only pays for taking the snapshot
+# (`State.to_metadata`). The queue is bounded: if the writer falls behind,
+# `submit` blocks until there is room again instead of piling up snapshots in
+# memory.
+#
+# Checkpoints for a path ending in `.ckpt` are appended to a checkpoint archive
+# (see checkpoint_archive.py), which is kept open until the writer is closed.
+
+
+class CheckpointWriter:
+    """Write CGPM state metadata to disk on a background thread."""
+
+    def __init__(self, max_pending=4):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.archives = {}
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                metadata, path = item
+                if self.error is None:
+                    self.write(metadata, path)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def write(self, metadata, path):
+        if is_checkpoint_archive(path):
+            if path not in self.archives:
+                self.archives[path] = ArchiveWriter(path)
+            self.archives[path].append(metadata)
+        else:
+            # Write atomically, so readers never see a partial file.
+            directory, name = os.path.split(path)
+            tmp = os.path.join(directory, "." + name)
+            write_metadata(metadata, tmp)
+            os.replace(tmp, path)
+
+    def check(self):
+        if self.error is not None:
+            raise RuntimeError("Writing a checkpoint failed.") from self.error
+
+    def submit(self, metadata, path):
+        """Queue `metadata` to be written to `path`. The caller must not modify
+        `metadata` afterwards."""
+        self.check()
+        self.queue.put((metadata, path))
+
+    def flush(self):
+        """Wait until all queued checkpoints are written."""
+        self.queue.join()
+        self.check()
+
+    def shutdown(self):
+        """Write the queued checkpoints, stop the thread and close the
+        archives. Errors are kept for `check` instead of being raised."""
+        self.queue.put(None)
+        self.thread.join()
+        for archive in self.archives.values():
+            try:
+                archive.close()
+            except Exception as e:
+                if self.error is None:
+                    self.error = e
+
+    def close(self):
+        self.shutdown()
+        self.check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Don't hide an exception raised in the with-body behind a failed
+        # checkpoint.
+        if exc_type is None:
+            self.close()
+        else:
+            self.shutdown()
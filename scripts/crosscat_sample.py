@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+import argparse
+import edn_format
+import numpy as np
+import pandas as pd
+import sys
+
+from edn_cache import load_edn
+
+# Samples synthetic data from an ensemble of CrossCat models, given as the
+# multimixture ASTs written by `ast_export.py` or `cgpm_to_sppl.py --ast`. The
+# samples follow the same distribution as those of `sppl_sample.py` on the
+# merged SPPL model, which is compiled from the same ASTs: the ensemble is an
+# equally weighted mixture of the models, and in every model each view draws a
+# cluster and then every column of the view from the cluster's distribution.
+#
+# Instead of walking the SPE for every sample, each view is compiled into
+# arrays of cluster weights and per-cluster parameters, and the samples of a
+# chunk are drawn with one batch of NumPy calls per view and column.
+#
+# Besides the types that `sppl_import.py` converts, the bernoulli, beta, lomax
+# and geometric columns written by `ast_export.py` are sampled as well, with
+# the parameterizations of scipy.stats, except that geometric samples count the
+# failures before the first success (starting at 0) as CGPM's geometric does.
+
+K = edn_format.Keyword
+
+PARAMS = {
+    "categorical": ["categorical/category->weight"],
+    "student-t": [
+        "student-t/degrees-of-freedom",
+        "student-t/location",
+        "student-t/scale",
+    ],
+    "negative-binom": ["negative-binom/n", "negative-binom/p"],
+    "bernoulli": ["bernoulli/p"],
+    "beta": ["beta/alpha", "beta/beta"],
+    "lomax": ["lomax/c", "lomax/scale"],
+    "geometric": ["geometric/p"],
+}
+
+
+def cumulative(weights):
+    """Return the cumulative weights of every row of `weights` normalized to
+    end in exactly 1, offset by the row index (see `draw`)."""
+    cdf = np.cumsum(np.asarray(weights, dtype=float), axis=-1)
+    cdf = np.atleast_2d(cdf / cdf[..., -1:])
+    return cdf + np.arange(len(cdf))[:, None]
+
+
+def draw(cdf, rows, u):
+    """Draw from the categorical distributions in `rows` of `cdf` (see
+    `cumulative`) using uniform variates `u`. Offsetting every row by its index
+    makes the flattened matrix sorted, so all draws take one searchsorted."""
+    k = cdf.shape[1]
+    return np.searchsorted(cdf.ravel(), rows + u, side="right") - rows * k
+
+
+def compile_view(clusters):
+    """Compile the clusters of a view (the value of :view/clusters) into the
+    cumulative cluster weights and, for every column, its distribution type,
+    parameter arrays with one entry per cluster and categories."""
+    weights = [cluster[K("cluster/weight")] for cluster in clusters]
+    primitives = [cluster[K("cluster/column->distribution")] for cluster in clusters]
+    columns = []
+    for column, primitive in primitives[0].items():
+        dist_type = primitive[K("distribution/type")].name.split("/")[-1]
+        assert dist_type in PARAMS, "Cannot sample primitive type: %s " % (dist_type,)
+        column_primitives = [p[column] for p in primitives]
+        if dist_type == "categorical":
+            key = K("categorical/category->weight")
+            categories = list(
+                dict.fromkeys(c for p in column_primitives for c in p[key])
+            )
+            weights_matrix = [
+                [p[key].get(c, 0.0) for c in categories] for p in column_primitives
+            ]
+            params = {"cdf": cumulative(weights_matrix)}
+            categories = np.asarray(categories, dtype=object)
+        else:
+            params = {
+                name: np.array([p[K(name)] for p in column_primitives], dtype=float)
+                for name in PARAMS[dist_type]
+            }
+            categories = None
+        columns.append((column, dist_type, params, categories))
+    return {"cdf": cumulative(weights), "columns": columns}
+
+
+def compile_model(ast):
+    return [
+        compile_view(view[K("view/clusters")]) for view in ast[K("multimixture/views")]
+    ]
+
+
+def sample_column(dist_type, params, categories, z, rng):
+    """Draw one sample of a column for every cluster assignment in `z`."""
+    if dist_type == "categorical":
+        return categories[draw(params["cdf"], z, rng.random(len(z)))]
+    elif dist_type == "student-t":
+        df = params["student-t/degrees-of-freedom"][z]
+        loc = params["student-t/location"][z]
+        scale = params["student-t/scale"][z]
+        return loc + scale * rng.standard_t(df)
+    elif dist_type == "negative-binom":
+        n = params["negative-binom/n"][z]
+        p = params["negative-binom/p"][z]
+        return rng.negative_binomial(n, p)
+    elif dist_type == "bernoulli":
+        return (rng.random(len(z)) < params["bernoulli/p"][z]).astype(np.int64)
+    elif dist_type == "beta":
+        return rng.beta(params["beta/alpha"][z], params["beta/beta"][z])
+    elif dist_type == "lomax":
+        # NumPy's Pareto distribution is the Lomax distribution with scale 1.
+        return params["lomax/scale"][z] * rng.pareto(params["lomax/c"][z])
+    elif dist_type == "geometric":
+        return rng.geometric(params["geometric/p"][z]) - 1
+
+
+def sample_model(views, N, rng):
+    """Draw `N` samples from a compiled model. Returns a dict of arrays."""
+    samples = {}
+    for view in views:
+        z = draw(view["cdf"], np.zeros(N, dtype=np.int64), rng.random(N))
+        for column, dist_type, params, categories in view["columns"]:
+            samples[column] = sample_column(dist_type, params, categories, z, rng)
+    return samples
+
+
+def sample_ensemble(models, columns, N, rng):
+    """Draw `N` samples of `columns` from the equally weighted mixture of the
+    compiled `models` as a DataFrame."""
+    counts = rng.multinomial(N, np.full(len(models), 1.0 / len(models)))
+    samples = [sample_model(views, n, rng) for views, n in zip(models, counts)]
+    order = rng.permutation(N)
+    return pd.DataFrame(
+        {c: np.concatenate([s[c] for s in samples])[order] for c in columns},
+        columns=columns,
+    )
+
+
+def main():
+    description = "Outputs samples from an ensemble of CrossCat models."
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        nargs="+",
+        type=argparse.FileType("r"),
+        help="Multimixture AST EDN of every model.",
+        metavar="AST",
+        dest="models",
+    )
+    parser.add_argument(
+        "--data",
+        type=argparse.FileType("r"),
+        help="Path to CSV used to generate the models.",
+    )
+    parser.add_argument(
+        "--sample_count",
+        type=int,
+        nargs="?",
+        default=None,
+        help="Number of joint simulations for QC",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=argparse.FileType("w+"),
+        help="Path to which samples will be written as CSV.",
+        default=sys.stdout,
+    )
+    parser.add_argument("--seed", type=int, default=1, help="Sampling seed.")
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=100000,
+        help="Number of samples drawn per chunk.",
+        metavar="NUM",
+        dest="chunk_size",
+    )
+    args = parser.parse_args()
+
+    if args.data is None:
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+
+    models = [compile_model(load_edn(f)) for f in args.models]
+    data = pd.read_csv(args.data)
+    columns = data.columns.tolist()
+    sample_count = args.sample_count or len(data)
+
+    # As in sppl_sample.py, chunk i is drawn with its own seed (seed, i).
+    for i, start in enumerate(range(0, max(sample_count, 1), args.chunk_size)):
+        n = min(args.chunk_size, sample_count - start)
+        rng = np.random.default_rng(np.random.SeedSequence([args.seed, i]))
+        chunk = sample_ensemble(models, columns, n, rng)
+        chunk.to_csv(args.output, index=False, header=i == 0)
+
+
+if __name__ == "__main__":
+    main()
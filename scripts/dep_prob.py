@@ -1,21 +1,126 @@
 import argparse
+import itertools
 import json
 import pandas as pd
-import itertools
 import numpy as np
 import sys
 
+from checkpoint_archive import CheckpointArchive
+from checkpoint_archive import is_checkpoint_archive
+from cgpm_model import read_metadata
 
-def dep_prob(cgpm_dicts, c1, c2, variable_mappings):
-    return np.mean(
-        [
-            float(
-                cgpm_dict["Zv"][variable_mappings[i][c1]]
-                == cgpm_dict["Zv"][variable_mappings[i][c2]]
-            )
-            for i, cgpm_dict in enumerate(cgpm_dicts)
-        ]
-    )
+# Number of cells in the indicator matrix built per chunk of models by
+# `dependence_matrix`.
+CHUNK_CELLS = 1 << 24
+
+
+def model_columns(cgpm_dict, columns):
+    """Return the columns of a model in the order of its column indices."""
+    # We assume that all passed in models have the same columns incorporated.
+    return list(cgpm_dict.get("col_names", columns))
+
+
+def zv_matrix(cgpm_dicts, n_columns):
+    """Stack the column-view assignments of all models into a (models x
+    columns) integer matrix. Columns that a model doesn't assign to a view are
+    -1."""
+    Zv = np.full((len(cgpm_dicts), n_columns), -1, dtype=np.int64)
+    for m, cgpm_dict in enumerate(cgpm_dicts):
+        for c, v in cgpm_dict["Zv"]:
+            Zv[m, c] = v
+    return Zv
+
+
+def dependence_matrix(Zv):
+    """Return the (columns x columns) matrix of the fraction of models in which
+    two columns are assigned to the same view. Unassigned columns (-1) are in
+    no view."""
+    n_models, n_columns = Zv.shape
+    counts = np.zeros((n_columns, n_columns))
+    # Give every (model, view) pair its own label. Then co-assignment counts are
+    # A @ A.T for the (columns x labels) indicator matrix A.
+    labels = (Zv - Zv.min(axis=1, keepdims=True)).astype(np.int64)
+    labels += np.arange(n_models)[:, None] * (labels.max(initial=0) + 1)
+    chunk = max(1, CHUNK_CELLS // (n_columns * n_columns))
+    for start in range(0, n_models, chunk):
+        _, inverse = np.unique(labels[start : start + chunk], return_inverse=True)
+        inverse = inverse.reshape(-1, n_columns)
+        assigned = Zv[start : start + chunk] >= 0
+        rows = np.broadcast_to(np.arange(n_columns), inverse.shape)
+        A = np.zeros((n_columns, inverse.max() + 1), dtype=np.float32)
+        A[rows[assigned], inverse[assigned]] = 1
+        counts += A @ A.T
+    return counts / n_models
+
+
+def coassignment(Zv):
+    """Return the (columns x columns) co-assignment matrix of every row of Zv,
+    i.e. the dependence matrix of every single model. Unassigned columns (-1)
+    are in no view."""
+    assigned = Zv >= 0
+    same = Zv[:, :, None] == Zv[:, None, :]
+    return same & assigned[:, :, None] & assigned[:, None, :]
+
+
+def deps_dict(P, columns):
+    """Convert a dependence matrix into nested dicts without the diagonal."""
+    if len(columns) < 2:
+        return {}
+    deps = {}
+    for i, c in enumerate(columns):
+        row = P[i].tolist()
+        deps[c] = dict(zip(columns[:i] + columns[i + 1 :], row[:i] + row[i + 1 :]))
+    return deps
+
+
+def dep_probs(cgpm_dicts, columns):
+    """Return the dependence probabilities of all pairs of columns over the
+    ensemble `cgpm_dicts` as a nested dict."""
+    columns = model_columns(cgpm_dicts[0], columns)
+    P = dependence_matrix(zv_matrix(cgpm_dicts, len(columns)))
+    return deps_dict(P, columns)
+
+
+def read_checkpoints(paths):
+    """Yield the checkpoints in `paths` in order. Checkpoint archives yield all
+    their checkpoints."""
+    for path in paths:
+        if is_checkpoint_archive(path):
+            with CheckpointArchive(path, arrays=()) as archive:
+                yield from archive
+        else:
+            yield read_metadata(path, arrays=())
+
+
+def write_series(cgpm_dicts, columns, f, chunk=64):
+    """Write the dependence probabilities of every model in `cgpm_dicts` (an
+    iterable of checkpoints of one chain) as a JSON array, one entry per
+    checkpoint."""
+    f.write("[")
+    first = True
+    batch = []
+
+    def flush():
+        nonlocal first
+        # A streaming chain incorporates more columns over time, so every
+        # checkpoint has its own columns. Consecutive checkpoints with the same
+        # columns are converted together.
+        groups = itertools.groupby(batch, key=lambda m: model_columns(m, columns))
+        for names, group in groups:
+            for P in coassignment(zv_matrix(list(group), len(names))):
+                if not first:
+                    f.write(",")
+                json.dump(deps_dict(P.astype(float), names), f)
+                first = False
+        batch.clear()
+
+    for cgpm_dict in cgpm_dicts:
+        batch.append(cgpm_dict)
+        if len(batch) == chunk:
+            flush()
+    if batch:
+        flush()
+    f.write("]\n")
 
 
 def main():
@@ -24,8 +129,8 @@ def main():
 
     parser.add_argument(
         nargs="+",
-        type=argparse.FileType("r"),
-        help="CGPM model JSON files.",
+        type=str,
+        help="CGPM model JSON files or CGPM archives.",
         default=[],
         metavar="MODEL",
         dest="models",
@@ -37,39 +142,22 @@ def main():
         "-o",
         "--output",
         type=argparse.FileType("w+"),
-        help="Path to SPPL JSON.",
+        help="Path to dep prob JSON.",
         default=sys.stdout,
     )
+    parser.add_argument(
+        "--series",
+        action="store_true",
+        help="Treat the models as consecutive checkpoints of one chain (checkpoint files or checkpoint archives) and write the dep prob of every checkpoint as a JSON array.",
+    )
     args = parser.parse_args()
-    cgpm_dicts = [json.load(model) for model in args.models]
-    df = pd.read_csv(args.data)
+    columns = pd.read_csv(args.data, nrows=0).columns.tolist()
 
-    # We assume that all passed in models have the same columns incorporated.
-    if "col_names" in cgpm_dicts[0]:
-        pairs = itertools.combinations(cgpm_dicts[0]["col_names"], 2)
-        variable_mappings = [
-            {c: i for i, c in enumerate(cgpm_dicts[0]["col_names"])}
-        ] * len(cgpm_dicts)
+    if args.series:
+        write_series(read_checkpoints(args.models), columns, args.output)
     else:
-        pairs = itertools.combinations(df.columns, 2)
-        variable_mappings = [{c: i for i, c in enumerate(df.columns)}] * len(cgpm_dicts)
-
-    deps = {}
-    # Turn Zv into dicts for speed and accessibility:
-    for cgpm_dict in cgpm_dicts:
-        cgpm_dict["Zv"] = dict(cgpm_dict["Zv"])
-
-    for c1, c2 in pairs:
-        p = dep_prob(cgpm_dicts, c1, c2, variable_mappings)
-        if c1 in deps:
-            deps[c1][c2] = p
-        else:
-            deps[c1] = {c2: p}
-        if c2 in deps:
-            deps[c2][c1] = p
-        else:
-            deps[c2] = {c1: p}
-    json.dump(deps, args.output)
+        cgpm_dicts = [read_metadata(model, arrays=()) for model in args.models]
+        json.dump(dep_probs(cgpm_dicts, columns), args.output)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,20 @@
+import edn_format
+
+from pickle_cache import load_cached
+
+# Parsing EDN with edn_format is slow, in particular for mapping tables with
+# high-cardinality nominal columns, and the same schema and mapping table are
+# parsed by many scripts in every pipeline run. `load_edn` caches the parsed
+# result as a pickle next to the EDN file, in a `.edn-cache` directory (see
+# `pickle_cache.py`).
+CACHE_DIR = ".edn-cache"
+
+
+def parse(text):
+    return edn_format.loads(text, write_ply_tables=False)
+
+
+def load_edn(f):
+    """Parse the EDN in the file object `f`, reusing a cached parse of the same
+    text if there is one."""
+    return load_cached(f, parse, CACHE_DIR)
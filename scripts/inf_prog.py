@@ -20,20 +20,40 @@ def init_stream(df):
     return columns, row_start_index
 
 
-def inf_prog(model):
-    """Incorporate data and run rejuvenation inference."""
+def advance(model, rows, block_size=1, weighted=False):
+    """Incorporate `rows` and run the periodic column transitions. Returns the
+    summed log weight of the rows (see `Streamcat.safe_incorporate_rows`)."""
+    log_weight = model.insert_rows(rows, block_size=block_size, weighted=weighted)
+    # Every 100 rows, transition the columns
+    if any((r % 100) == 0 for r in rows):
+        model.transition_cols()
+    return log_weight
+
+
+def inf_prog(model, block_size=1, checkpoint_every=50, hooks=()):
+    """Incorporate data and run rejuvenation inference.
+
+    Rows are incorporated in blocks of `block_size` rows with one row
+    transition per block. A checkpoint is saved every `checkpoint_every`
+    rows. Every hook is called as `hook(model)` after every block and as
+    `hook(model, done=True)` at the end (see stream_summary.py). The model's
+    checkpoint archive is closed after the last checkpoint."""
     # Loop over rows and insert them.
     model.save_checkpoint()
-    for t in range(model.incorporated_rows, model.T):
-        model.insert_rows([t])
-        # Every 100 rows, transition the columns
-        if (t % 100) == 0:
-            model.transition_cols()
-        # Every 50 rows, save a checkpoint.
-        if (t % 50) == 0:
+    t = model.incorporated_rows
+    while t < model.T:
+        rows = range(t, min(t + block_size, model.T))
+        advance(model, rows, block_size=block_size)
+        if any((r % checkpoint_every) == 0 for r in rows):
             model.save_checkpoint()
+        for hook in hooks:
+            hook(model)
+        t = rows.stop
     model.transition(N=10)
     model.save_checkpoint()
+    model.close()
+    for hook in hooks:
+        hook(model, done=True)
     # Change the above to run more inference if you are not happy with inference
     # quality!
     return model
@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 
 import argparse
-import edn_format
 import itertools
 import json
 import pandas
@@ -10,6 +9,7 @@ import numpy as np
 import scipy.stats as stats
 import warnings
 from collections import defaultdict
+from edn_cache import load_edn
 
 # Monkey patching this to work around https://github.com/scipy/scipy/pull/7838
 infinite_F = 1e10  # large value to use for writing infinity to json
@@ -63,6 +63,71 @@ def lin_reg(xs, ys):
     }
 
 
+def numerical_stats(df):
+    """Compute `lin_reg` for all ordered pairs of the (numerical) columns of
+    `df`, each on the rows where both columns are present, as `main` would.
+    Returns a dict from (c1, c2), where c2 is regressed on c1, to the stats.
+
+    Instead of one regression per pair, the pairwise complete counts, sums and
+    cross products of all columns are computed with a few matrix products over
+    the mask of present values, and the regressions are derived from them in
+    bulk. Pairs with at most one complete row, or whose x values are all
+    identical, get `placeholder_stats`."""
+    columns = list(df.columns)
+    X = df.to_numpy(dtype=float)
+    present = ~np.isnan(X)
+    # Center the columns first to limit cancellation in the moments below.
+    shift = np.zeros(X.shape[1])
+    has_values = present.any(axis=0)
+    shift[has_values] = np.nanmean(X[:, has_values], axis=0)
+    Xc = np.where(present, X - shift, 0.0)
+    M = present.astype(float)
+
+    # For the pair (i, j), entry [i, j] is computed over the rows in which
+    # both columns are present.
+    n = M.T @ M
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_x = (Xc.T @ M) / n
+        mean_y = mean_x.T
+        square_x = ((Xc**2).T @ M) / n
+        square_y = square_x.T
+        ssxm = square_x - mean_x**2
+        ssym = square_y - mean_y**2
+        ssxym = (Xc.T @ Xc) / n - mean_x * mean_y
+
+        # Moments that are zero up to rounding are zero, as in linregress.
+        constant_x = ssxm <= 1e-12 * square_x
+        constant_y = ssym <= 1e-12 * square_y
+        r = ssxym / np.sqrt(ssxm * ssym)
+        r = np.where(constant_x | constant_y, 0.0, np.clip(r, -1.0, 1.0))
+        slope = ssxym / ssxm
+        intercept = (mean_y + shift[None, :]) - slope * (mean_x + shift[:, None])
+
+        dof = n - 2
+        TINY = 1.0e-20
+        t = r * np.sqrt(dof / ((1.0 - r + TINY) * (1.0 + r + TINY)))
+        p = 2 * stats.t.sf(np.abs(t), np.maximum(dof, 1))
+    # With two points, linregress reports p = 1 if the y values are equal and
+    # p = 0 otherwise.
+    p = np.where(n == 2, np.where(constant_y, 1.0, 0.0), p)
+
+    results = {}
+    for i, c1 in enumerate(columns):
+        for j, c2 in enumerate(columns):
+            if i == j:
+                continue
+            if n[i, j] <= 1 or constant_x[i, j]:
+                results[(c1, c2)] = placeholder_stats(["numerical", "numerical"])
+                continue
+            results[(c1, c2)] = {
+                "slope": float(slope[i, j]),
+                "intercept": float(intercept[i, j]),
+                "r-value": float(r[i, j]),
+                "p-value": float(p[i, j]),
+            }
+    return results
+
+
 def chi_squared(xs, ys):
     """Compute chi-square statistic"""
     contingency = pandas.crosstab(xs, ys)
@@ -117,26 +182,34 @@ def main():
     args = parser.parse_args()
     df = pandas.read_csv(args.data)
 
-    schema = edn_format.loads(args.schema.read(), write_ply_tables=False)
+    schema = load_edn(args.schema)
 
-    pairs = itertools.permutations(df.columns, 2)
+    columns = [c for c in df.columns if schema[c].name != "ignore"]
+    numerical = [c for c in columns if schema[c].name == "numerical"]
 
-    results = defaultdict(dict)
-
-    for c1, c2 in pairs:
+    # All numerical pairs are computed at once. The stats of the other pairs
+    # don't depend on the order of the columns, so they are computed once per
+    # unordered pair.
+    pair_stats = numerical_stats(df[numerical])
+    for c1, c2 in itertools.combinations(columns, 2):
         stattypes = [schema[c1].name, schema[c2].name]
-        if "ignore" in stattypes:
+        if stattypes == ["numerical", "numerical"]:
             continue
         pair_df = df[[c1, c2]].dropna()
 
         if len(pair_df) <= 1:
-            results[c1][c2] = placeholder_stats(stattypes)
+            pair_stats[(c1, c2)] = placeholder_stats(stattypes)
 
         else:
             c1_vals = pair_df[c1].values
             c2_vals = pair_df[c2].values
 
-            results[c1][c2] = compute_stats(stattypes, c1_vals, c2_vals)
+            pair_stats[(c1, c2)] = compute_stats(stattypes, c1_vals, c2_vals)
+        pair_stats[(c2, c1)] = pair_stats[(c1, c2)]
+
+    results = defaultdict(dict)
+    for c1, c2 in itertools.permutations(columns, 2):
+        results[c1][c2] = pair_stats[(c1, c2)]
 
     json.dump(results, args.output)
 
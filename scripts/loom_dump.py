@@ -6,10 +6,30 @@ import itertools
 import json
 import loom.cFormat as cFormat
 import loom.schema_pb2 as schema_pb2
+import numpy as np
 import os
 import sys
 
 
+def load_assignments(assign_in, num_kinds):
+    """Decode a Loom assignment stream into an array of group ids with one row
+    per Loom row and one column per kind, sorted by rowid. The group ids are
+    decoded by Loom's C++ reader and copied into the array by `np.fromiter`,
+    so that no Python objects are kept around per cell."""
+    rowids = []
+    kinds = range(num_kinds)
+
+    def cells():
+        for a in cFormat.assignment_stream_load(assign_in):
+            rowids.append(a.rowid)
+            for k in kinds:
+                yield a.groupids(k)
+
+    groupids = np.fromiter(cells(), dtype=np.int32).reshape(-1, num_kinds)
+    order = np.argsort(np.asarray(rowids, dtype=np.int64), kind="mergesort")
+    return groupids[order]
+
+
 def loom_metadata(path):
     model_in = os.path.join(path, "model.pb.gz")
     assign_in = os.path.join(path, "assign.pbs.gz")
@@ -26,18 +46,51 @@ def loom_metadata(path):
             )
         )
         num_kinds = len(cross_cat.kinds)
-        assignments = {
-            a.rowid: [a.groupids(k) for k in range(num_kinds)]
-            for a in cFormat.assignment_stream_load(assign_in)
-        }
-        rowids = sorted(assignments)
-        zrv = [
-            [k, [assignments[rowid][k] for rowid in rowids]] for k in range(num_kinds)
-        ]
+        assignments = load_assignments(assign_in, num_kinds)
+        zrv = [[k, assignments[:, k]] for k in range(num_kinds)]
 
         return {"Zv": zv, "Zrv": zrv, "hooked_cgpms": {}}
 
 
+def int_array_json(array):
+    """Return the JSON list of the non-negative integers in `array`. The text
+    is built by NumPy, one row of digits per integer, instead of converting
+    every integer to a Python object."""
+    array = np.asarray(array, dtype=np.int64)
+    if array.size == 0:
+        return "[]"
+    assert array.min() >= 0
+    width = len(str(array.max()))
+    powers = 10 ** np.arange(width - 1, -1, -1)
+    chars = np.full((array.size, width + 1), ord(","), dtype=np.uint8)
+    chars[:, :width] = array[:, None] // powers % 10 + ord("0")
+    # Blank out leading zeros, and drop the last comma and all blanks.
+    chars[:, :width][(array[:, None] < powers) & (powers > 1)] = 0
+    chars = chars.ravel()[:-1]
+    return "[" + chars[chars != 0].tobytes().decode("ascii") + "]"
+
+
+def write_json(value, f):
+    """Write `value` (see `loom_metadata`) to the file `f` as JSON, with its
+    NumPy arrays written by `int_array_json`."""
+    if isinstance(value, np.ndarray):
+        f.write(int_array_json(value))
+    elif isinstance(value, dict):
+        f.write("{")
+        for i, (k, v) in enumerate(value.items()):
+            f.write((", " if i > 0 else "") + json.dumps(k) + ": ")
+            write_json(v, f)
+        f.write("}")
+    elif isinstance(value, (list, tuple)):
+        f.write("[")
+        for i, v in enumerate(value):
+            f.write(", " if i > 0 else "")
+            write_json(v, f)
+        f.write("]")
+    else:
+        f.write(json.dumps(value))
+
+
 def dir_path(string):
     if os.path.isdir(string):
         return string
@@ -50,7 +103,13 @@ def main():
     description = "Write a Loom model to disk as CGPM state metadata."
     parser = argparse.ArgumentParser(description=description)
 
-    parser.add_argument("sample", type=dir_path, help="Path to Loom sample directory.")
+    parser.add_argument(
+        "samples",
+        type=dir_path,
+        nargs="+",
+        help="Path to Loom sample directory.",
+        metavar="sample",
+    )
     parser.add_argument(
         "-o",
         "--output",
@@ -58,15 +117,30 @@ def main():
         help="File to write metadata JSON to.",
         default=sys.stdout,
     )
+    parser.add_argument(
+        "--lines",
+        action="store_true",
+        help=(
+            "Write one JSON object per line and sample, with the sample's name "
+            "and its metadata. Samples are written in sorted order."
+        ),
+    )
 
     args = parser.parse_args()
 
-    if args.sample is None:
-        parser.print_help(sys.stderr)
-        sys.exit(1)
+    if not args.lines:
+        if len(args.samples) != 1:
+            parser.error("Multiple samples can only be dumped with --lines.")
+        metadata = loom_metadata(args.samples[0])
+        write_json(metadata, args.output)
+        return
 
-    metadata = loom_metadata(args.sample)
-    json.dump(metadata, args.output)
+    for sample in sorted(args.samples):
+        name = os.path.basename(os.path.normpath(sample))
+        line = {"name": name, "metadata": loom_metadata(sample)}
+        write_json(line, args.output)
+        args.output.write("\n")
+        args.output.flush()
 
 
 if __name__ == "__main__":
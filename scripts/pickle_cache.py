@@ -0,0 +1,72 @@
+import hashlib
+import os
+import pickle
+
+# A cache of parsed files. `load_cached` stores the result of parsing a file as
+# a pickle next to the file, in a cache directory. Cache files are keyed by the
+# hash of the file's contents (and a version string for the parser), so a
+# changed file is never read from a stale cache.
+
+
+def cache_path(path, data, directory, version=""):
+    digest = hashlib.sha256(data + version.encode("utf-8")).hexdigest()
+    directory = os.path.join(os.path.dirname(os.path.abspath(path)), directory)
+    return os.path.join(
+        directory, "{}.{}.pickle".format(os.path.basename(path), digest)
+    )
+
+
+def remove_stale(cached):
+    """Remove the caches of earlier versions of the same file."""
+    directory, name = os.path.split(cached)
+    prefix = name.rsplit(".", 2)[0] + "."
+    for other in os.listdir(directory):
+        if other != name and other.startswith(prefix) and other.endswith(".pickle"):
+            try:
+                os.remove(os.path.join(directory, other))
+            except OSError:
+                pass
+
+
+def file_path(f):
+    """Return the path of the regular file that `f` reads from, or None, e.g.
+    for stdin."""
+    path = getattr(f, "name", None)
+    if not isinstance(path, str) or not os.path.isfile(path):
+        return None
+    return path
+
+
+def load_cached(f, parse, directory, version="", dispatch_table=None):
+    """Return `parse(text)` for the contents of the file object `f`, reusing a
+    cached result for the same contents if there is one. `dispatch_table`
+    (see `copyreg`) overrides how objects are pickled in the cache."""
+    text = f.read()
+    path = file_path(f)
+    if path is None:
+        # Nothing to key a cache on, e.g. when reading from stdin.
+        return parse(text)
+
+    data = text.encode("utf-8") if isinstance(text, str) else text
+    cached = cache_path(path, data, directory, version)
+    try:
+        with open(cached, "rb") as cache:
+            return pickle.load(cache)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+
+    value = parse(text)
+    try:
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        # Write atomically, other processes might be reading the same cache.
+        tmp = "{}.{}.tmp".format(cached, os.getpid())
+        with open(tmp, "wb") as cache:
+            pickler = pickle.Pickler(cache, protocol=pickle.HIGHEST_PROTOCOL)
+            if dispatch_table is not None:
+                pickler.dispatch_table = dispatch_table
+            pickler.dump(value)
+        os.replace(tmp, cached)
+        remove_stale(cached)
+    except OSError:
+        pass  # Caching is best-effort.
+    return value
@@ -1,5 +1,4 @@
 import argparse
-import edn_format
 import numpy as np
 import pandas as pd
 import sys
@@ -7,6 +6,7 @@ import yaml
 
 from catboost import CatBoostClassifier
 from catboost import CatBoostRegressor
+from edn_cache import load_edn
 from sklearn.linear_model import LinearRegression
 from sklearn.linear_model import LogisticRegression
 from sklearn.preprocessing import OneHotEncoder
@@ -154,10 +154,7 @@ def main():
         metavar="PATH",
     )
     args = parser.parse_args()
-    schema = {
-        k: v.name
-        for k, v in edn_format.loads(args.schema.read(), write_ply_tables=False).items()
-    }
+    schema = {k: v.name for k, v in load_edn(args.schema).items()}
 
     with open("params.yaml", "r") as f:
         params = yaml.safe_load(f.read())
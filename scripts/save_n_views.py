@@ -4,6 +4,8 @@ import argparse
 import json
 import sys
 
+from cgpm_model import read_metadata
+
 
 def dep_prob(cgpm_dicts, c1, c2, variable_mappings):
     return np.mean(
@@ -25,14 +27,14 @@ def main():
 
     parser.add_argument(
         nargs="+",
-        type=argparse.FileType("r"),
-        help="CGPM model JSON files.",
+        type=str,
+        help="CGPM model JSON files or CGPM archives.",
         default=[],
         metavar="MODEL",
         dest="models",
     )
     args = parser.parse_args()
-    cgpm_dicts = [json.load(model) for model in args.models]
+    cgpm_dicts = [read_metadata(model, arrays=()) for model in args.models]
 
     for cgpm_dict in cgpm_dicts:
         cgpm_dict["Zv"] = dict(cgpm_dict["Zv"])
@@ -0,0 +1,157 @@
+import multiprocessing
+import numpy as np
+import os
+from scipy.special import logsumexp
+
+import cgpm.utils.general as general
+
+from inf_prog import advance
+from stream_cat import Streamcat
+
+# Sequential Monte Carlo over a stream of rows. Every particle is a Streamcat
+# model. After each block of rows a particle's weight is multiplied by the
+# predictive density of the block, and when the effective sample size drops
+# below `ess_threshold` times the number of particles the particles are
+# resampled and rejuvenated with a few transitions.
+#
+# Particles live in long-running worker processes, so the data matrix is only
+# sent to each worker once. Copying a particle on resampling only sends its
+# latent state (`Streamcat.snapshot`) between processes.
+
+
+def effective_sample_size(log_weights):
+    log_weights = np.asarray(log_weights, dtype=float)
+    return np.exp(2 * logsumexp(log_weights) - logsumexp(2 * log_weights))
+
+
+def systematic_resample(log_weights, rng):
+    """Return the indices of the ancestors of the resampled particles."""
+    log_weights = np.asarray(log_weights, dtype=float)
+    n = len(log_weights)
+    weights = np.exp(log_weights - logsumexp(log_weights))
+    positions = (rng.uniform() + np.arange(n)) / n
+    indices = np.searchsorted(np.cumsum(weights), positions)
+    return np.minimum(indices, n - 1)
+
+
+def worker(conn, metadata, seeds):
+    """Hold the particles with `seeds` (keyed by particle index) and run the
+    commands sent over `conn` until "close"."""
+    models = {
+        i: Streamcat.from_metadata(dict(metadata, seed=seed))
+        for i, seed in seeds.items()
+    }
+    while True:
+        command, args = conn.recv()
+        if command == "advance":
+            rows, block_size = args
+            conn.send(
+                {
+                    i: advance(model, rows, block_size=block_size, weighted=True)
+                    for i, model in models.items()
+                }
+            )
+        elif command == "snapshot":
+            conn.send({i: models[i].snapshot() for i in args})
+        elif command == "restore":
+            for i, snapshot in args.items():
+                models[i].restore(snapshot)
+            conn.send(None)
+        elif command == "transition":
+            for model in models.values():
+                model.transition(N=args)
+            conn.send(None)
+        elif command == "metadata":
+            conn.send({i: model.to_metadata() for i, model in models.items()})
+        elif command == "close":
+            conn.close()
+            return
+
+
+class Particles:
+    """A set of particles spread over worker processes."""
+
+    def __init__(self, metadata, n_particles, seed, workers=None):
+        self.n_particles = n_particles
+        workers = min(workers or os.cpu_count(), n_particles)
+        # Particle i is held by worker i % workers.
+        self.owner = [i % workers for i in range(n_particles)]
+        self.conns = []
+        self.processes = []
+        for w in range(workers):
+            seeds = {i: seed + i for i in range(n_particles) if self.owner[i] == w}
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=worker, args=(child, metadata, seeds), daemon=True
+            )
+            process.start()
+            self.conns.append(parent)
+            self.processes.append(process)
+
+    def broadcast(self, command, args=None):
+        for conn in self.conns:
+            conn.send((command, args))
+        return [conn.recv() for conn in self.conns]
+
+    def gather(self, command, args=None):
+        results = {}
+        for result in self.broadcast(command, args):
+            results.update(result)
+        return [results[i] for i in range(self.n_particles)]
+
+    def resample(self, ancestors):
+        """Replace every particle by a copy of its ancestor."""
+        moves = {i: int(a) for i, a in enumerate(ancestors) if int(a) != i}
+        needed = sorted(set(moves.values()))
+        requests = [
+            [i for i in needed if self.owner[i] == w] for w in range(len(self.conns))
+        ]
+        for conn, request in zip(self.conns, requests):
+            conn.send(("snapshot", request))
+        snapshots = {}
+        for conn in self.conns:
+            snapshots.update(conn.recv())
+        for w, conn in enumerate(self.conns):
+            restores = {i: snapshots[a] for i, a in moves.items() if self.owner[i] == w}
+            conn.send(("restore", restores))
+        for conn in self.conns:
+            conn.recv()
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(("close", None))
+        for process in self.processes:
+            process.join()
+
+
+def smc(
+    metadata,
+    n_particles,
+    seed,
+    workers=None,
+    block_size=1,
+    ess_threshold=0.5,
+    rejuvenation=1,
+):
+    """Run SMC over the rows of `metadata["X"]` that are not yet incorporated.
+    Returns the metadata of `n_particles` equally weighted particles."""
+    rng = general.gen_rng(seed)
+    particles = Particles(metadata, n_particles, seed, workers=workers)
+    try:
+        log_weights = np.zeros(n_particles)
+        T = len(metadata["X"])
+        t = metadata["incorporated_rows"]
+        while t < T:
+            rows = range(t, min(t + block_size, T))
+            log_weights += particles.gather("advance", (rows, block_size))
+            if effective_sample_size(log_weights) < ess_threshold * n_particles:
+                particles.resample(systematic_resample(log_weights, rng))
+                particles.broadcast("transition", rejuvenation)
+                log_weights = np.zeros(n_particles)
+            t = rows.stop
+        if np.any(log_weights != log_weights[0]):
+            particles.resample(systematic_resample(log_weights, rng))
+        particles.broadcast("transition", 10)
+        return particles.gather("metadata")
+    finally:
+        particles.close()
@@ -0,0 +1,52 @@
+import copyreg
+import json
+import spe_dag
+import sppl
+
+from pickle_cache import file_path
+from pickle_cache import load_cached
+from sppl.transforms import Identity
+
+# Building an SPE from JSON dominates short jobs on large merged models, and
+# the same model is loaded by every SPPL script. `load_spe` caches the built
+# SPE as a pickle next to the model file, in a `.spe-cache` directory (see
+# `pickle_cache.py`). Caches are also keyed by the SPPL version.
+CACHE_DIR = ".spe-cache"
+
+# Identity defines __hash__ with an attribute that is set in __init__, so it
+# has to be rebuilt from its token before it is used as a dict key (e.g. in the
+# environments of leaves) during unpickling. The reducer is only used by the
+# cache's own pickler, not registered globally with copyreg.
+#
+# SPEs, and events and symbols built from Identity, therefore can't be pickled
+# with the standard pickler and must never cross process boundaries, e.g. in
+# the `initargs` of a process pool under the spawn start method. Pools pass the
+# path of the model file (see `file_path`) and plain column names instead, and
+# every worker loads the model with `load_spe_path`, which reads the cache that
+# the parent process wrote when it loaded the same file.
+
+
+def reduce_identity(identity):
+    return Identity, (identity.token,)
+
+
+DISPATCH_TABLE = copyreg.dispatch_table.copy()
+DISPATCH_TABLE[Identity] = reduce_identity
+
+
+def parse(text):
+    return spe_dag.spe_from_json(json.loads(text))
+
+
+def load_spe(f):
+    """Load the SPE model (tree or DAG JSON) in the file object `f`, reusing a
+    cached build of the same file if there is one."""
+    return load_cached(
+        f, parse, CACHE_DIR, version=sppl.__version__, dispatch_table=DISPATCH_TABLE
+    )
+
+
+def load_spe_path(path):
+    """Load the SPE model in the file `path` (see `load_spe`)."""
+    with open(path) as f:
+        return load_spe(f)
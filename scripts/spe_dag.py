@@ -0,0 +1,113 @@
+import scipy.stats as stats
+
+# Monkey patching this to work around https://github.com/scipy/scipy/pull/7838
+
+if not hasattr(stats, "frechet_r"):
+    stats.frechet_r = stats.weibull_max
+
+if not hasattr(stats, "frechet_l"):
+    stats.frechet_l = stats.weibull_min
+
+import json
+import sppl.compilers.spe_to_dict as spe_to_dict
+
+from sppl.spe import ProductSPE
+from sppl.spe import SumSPE
+
+# SPPL serializes an SPE as a tree (`spe_to_dict`), so a subtree that occurs k
+# times in an ensemble is written, parsed and held in memory k times. Padding
+# leaves, cluster-index leaves and unchanged views of warm-started chains are
+# the same across ensemble members. This module hash-conses SPE dicts into a
+# table of unique nodes, in which internal nodes refer to their children by
+# index, and builds SPEs that share those nodes.
+#
+# The DAG is serialized as
+#
+#   {"class": "SPEDAG", "nodes": [...], "root": i}
+#
+# where nodes are in the format of `spe_to_dict`, except that the "children" of
+# SumSPE and ProductSPE nodes are indices of earlier nodes.
+DAG_CLASS = "SPEDAG"
+
+
+class NodeTable:
+    """A table of unique SPE dict nodes."""
+
+    def __init__(self):
+        self.nodes = []
+        self.index = {}
+
+    def add(self, node):
+        key = json.dumps(node, sort_keys=True)
+        if key not in self.index:
+            self.index[key] = len(self.nodes)
+            self.nodes.append(node)
+        return self.index[key]
+
+    def intern(self, spe_dict, memo=None):
+        """Add the tree `spe_dict` to the table and return the index of its
+        root."""
+        # Subtrees that are the same dict object are only hashed once.
+        if memo is None:
+            memo = {}
+        if id(spe_dict) not in memo:
+            if "children" in spe_dict:
+                children = [self.intern(c, memo) for c in spe_dict["children"]]
+                memo[id(spe_dict)] = self.add(dict(spe_dict, children=children))
+            else:
+                memo[id(spe_dict)] = self.add(spe_dict)
+        return memo[id(spe_dict)]
+
+    def to_dag(self, root):
+        return {"class": DAG_CLASS, "nodes": self.nodes, "root": root}
+
+
+def build(nodes):
+    """Build the SPEs of all `nodes` (see `NodeTable`). Every node is built
+    once and shared by all its parents."""
+    spes = []
+    for node in nodes:
+        if node["class"] == "SumSPE":
+            children = [spes[i] for i in node["children"]]
+            spes.append(SumSPE(children, node["weights"]))
+        elif node["class"] == "ProductSPE":
+            children = [spes[i] for i in node["children"]]
+            spes.append(ProductSPE(children))
+        else:
+            spes.append(spe_to_dict.spe_from_dict(node))
+    return spes
+
+
+def is_dag(spe_json):
+    return spe_json.get("class") == DAG_CLASS
+
+
+def spe_from_json(spe_json):
+    """Build an SPE from either a `spe_to_dict` tree or a DAG. Identical
+    subtrees are shared in both cases."""
+    if is_dag(spe_json):
+        return build(spe_json["nodes"])[spe_json["root"]]
+    table = NodeTable()
+    root = table.intern(spe_json)
+    return build(table.nodes)[root]
+
+
+def spe_to_tree(spe, memo=None):
+    """Like `spe_to_dict`, but converts shared nodes once."""
+    if memo is None:
+        memo = {}
+    if id(spe) not in memo:
+        if isinstance(spe, SumSPE):
+            memo[id(spe)] = {
+                "class": "SumSPE",
+                "children": [spe_to_tree(c, memo) for c in spe.children],
+                "weights": spe.weights,
+            }
+        elif isinstance(spe, ProductSPE):
+            memo[id(spe)] = {
+                "class": "ProductSPE",
+                "children": [spe_to_tree(c, memo) for c in spe.children],
+            }
+        else:
+            memo[id(spe)] = spe_to_dict.spe_to_dict(spe)
+    return memo[id(spe)]
@@ -0,0 +1,274 @@
+import itertools
+import math
+import multiprocessing
+import numpy as np
+
+from collections import OrderedDict
+from spe_cache import load_spe_path
+from sppl.math_util import logdiffexp
+from sppl.math_util import logsumexp
+from sppl.transforms import Identity as I
+
+# Event-based mutual information between the columns of an SPE. Every column c
+# has a fixed predicate (see `get_predicate`), and the MI of a pair of columns
+# is the MI of the binary variables given by their predicates.
+#
+# `SPE.mutual_information` computes the probabilities of both marginal events
+# and of three joint events for every pair. Here the marginal probabilities are
+# computed once per column and shared by all pairs through `EventCache`, and
+# only P(A & B) is computed per pair: P(A & ~B) and P(~A & B) follow from it and
+# the marginals.
+#
+# Pairs can be computed by a pool of worker processes. Every pair (i, j) of
+# column indices gets its own seed (seed, i, j), so results don't depend on the
+# number of workers or the order in which pairs are computed. SPEs and events
+# can't be sent to worker processes (see spe_cache.py), so workers are given
+# the path of the model file and the columns and their configs, and load the
+# model and build the predicates themselves.
+#
+# For large ensembles the exact probabilities are expensive, and
+# `monte_carlo_mi` estimates the MI of all pairs from one set of joint samples
+# instead: the samples are drawn in chunks (chunk i with seed (seed, i)), every
+# chunk is reduced to the counts of A and of A & B for all pairs of predicates,
+# and the MI is computed from the empirical probabilities. Its standard error
+# is the delta method's, sqrt((E[log(p / (pA pB))^2] - MI^2) / samples).
+
+
+def get_predicate(c, v):
+    if isinstance(v, list):
+        return I(c) << set(v)
+    elif isinstance(v, float):
+        return I(c) > v
+
+
+class EventCache:
+    """An LRU cache of the log probabilities of events under `spe`."""
+
+    def __init__(self, spe, maxsize=1024):
+        self.spe = spe
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+
+    def logprob(self, event):
+        if event in self.cache:
+            self.cache.move_to_end(event)
+            return self.cache[event]
+        lp = self.spe.logprob(event)
+        self.cache[event] = lp
+        if len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+        return lp
+
+
+def logprob_difference(lp, lp_joint):
+    """Return log(exp(lp) - exp(lp_joint)), the log probability of A & ~B given
+    log P(A) and log P(A & B)."""
+    if lp_joint >= lp:
+        return -math.inf
+    return logdiffexp(lp, lp_joint)
+
+
+def mi_from_logprobs(lpA1, lpB1, lp11):
+    """Return the MI of the events A and B from log P(A), log P(B) and
+    log P(A & B), as `SPE.mutual_information` does."""
+    lpA0 = logdiffexp(0, lpA1)
+    lpB0 = logdiffexp(0, lpB1)
+    lp10 = logprob_difference(lpA1, lp11)
+    lp01 = logprob_difference(lpB1, lp11)
+    lp00 = logprob_difference(0, logsumexp([lp11, lp10, lp01]))
+
+    def term(lp, lpA, lpB):
+        return math.exp(lp) * (lp - (lpA + lpB)) if lp != -math.inf else 0
+
+    return (
+        term(lp11, lpA1, lpB1)
+        + term(lp10, lpA1, lpB0)
+        + term(lp01, lpA0, lpB1)
+        + term(lp00, lpA0, lpB0)
+    )
+
+
+def mutual_information(events, A, B):
+    """Return the MI of the events A and B, reusing the probabilities of A and
+    B in the `EventCache` `events`."""
+    return mi_from_logprobs(
+        events.logprob(A), events.logprob(B), events.spe.logprob(A & B)
+    )
+
+
+def pair_seed(seed, i, j):
+    return np.random.SeedSequence([seed, i, j])
+
+
+# The model, predicates and marginal log probabilities are set once per worker
+# by `init_worker` so that they don't have to be sent with every pair.
+_worker_state = {}
+
+
+def load_model(model):
+    """Return the SPE `model`, loading it first if it is the path of a model
+    file."""
+    return load_spe_path(model) if isinstance(model, str) else model
+
+
+def init_worker(model, cols, configs, logprobs, seed):
+    _worker_state.update(
+        spe=load_model(model),
+        predicates=[(c, get_predicate(c, configs[c])) for c in cols],
+        logprobs=logprobs,
+        seed=seed,
+    )
+
+
+def pair_mi(pair):
+    """Compute the MI of the pair of column indices `pair`."""
+    i, j = pair
+    state = _worker_state
+    (c1, A), (c2, B) = state["predicates"][i], state["predicates"][j]
+    np.random.seed(pair_seed(state["seed"], i, j).generate_state(1)[0])
+    lp11 = state["spe"].logprob(A & B)
+    return c1, c2, mi_from_logprobs(state["logprobs"][c1], state["logprobs"][c2], lp11)
+
+
+def iter_pairwise_mi(spe, configs, cols, seed=1, workers=1, skip=(), model_path=None):
+    """Yield (c1, c2, mi) for all pairs of `cols` except the pairs in `skip`,
+    in the order in which they are computed. The predicate of every column is
+    given by `configs`. With more than one worker, `model_path` has to be the
+    path of the file `spe` was loaded from."""
+    events = EventCache(spe, maxsize=max(len(cols), 1))
+    logprobs = {c: events.logprob(get_predicate(c, configs[c])) for c in cols}
+    skip = set(skip)
+    pairs = [
+        (i, j)
+        for i, j in itertools.combinations(range(len(cols)), 2)
+        if (cols[i], cols[j]) not in skip
+    ]
+    configs = {c: configs[c] for c in cols}
+    if workers <= 1 or len(pairs) <= 1:
+        init_worker(spe, cols, configs, logprobs, seed)
+        yield from map(pair_mi, pairs)
+        return
+    assert model_path is not None, "Workers need the path of the model."
+    initargs = (model_path, cols, configs, logprobs, seed)
+    with multiprocessing.Pool(
+        processes=min(workers, len(pairs)),
+        initializer=init_worker,
+        initargs=initargs,
+    ) as pool:
+        chunksize = max(1, len(pairs) // (4 * workers))
+        yield from pool.imap_unordered(pair_mi, pairs, chunksize=chunksize)
+
+
+def pairwise_mi(spe, configs, cols, seed=1, workers=1, model_path=None):
+    """Return the MI of all pairs of `cols` as a nested dict, with the
+    predicate of every column given by `configs` (see `iter_pairwise_mi`)."""
+    mi = {c: {} for c in cols}
+    for c1, c2, value in iter_pairwise_mi(
+        spe, configs, cols, seed, workers, model_path=model_path
+    ):
+        mi[c1][c2] = value
+        mi[c2][c1] = value
+    return mi
+
+
+def indicators(values, v):
+    """Evaluate the predicate of `get_predicate(c, v)` on the samples
+    `values` of column c."""
+    if isinstance(v, list):
+        return np.isin(np.asarray(values, dtype=object), v)
+    return np.asarray(values, dtype=float) > v
+
+
+def init_sampler(model, cols, configs, seed):
+    _worker_state.update(spe=load_model(model), cols=cols, configs=configs, seed=seed)
+
+
+def chunk_counts(chunk):
+    """Draw chunk `i` of `n` joint samples and return the (columns x columns)
+    matrix of the number of samples in which both predicates hold."""
+    i, n = chunk
+    state = _worker_state
+    seed_sequence = np.random.SeedSequence([state["seed"], i])
+    prng = np.random.RandomState(seed_sequence.generate_state(4))
+    symbols = [I(c) for c in state["cols"]]
+    samples = state["spe"].sample_subset(symbols, n, prng=prng)
+    X = np.column_stack(
+        [
+            indicators([row[symbol] for row in samples], state["configs"][c])
+            for c, symbol in zip(state["cols"], symbols)
+        ]
+    ).astype(float)
+    return X.T @ X
+
+
+def mi_from_counts(counts, n):
+    """Return the plug-in MI and its standard error for all pairs from the
+    joint counts of the predicates (see `chunk_counts`) in `n` samples."""
+    p11 = counts / n
+    pA = np.diag(p11)
+    pA1, pB1 = pA[:, None], pA[None, :]
+    cells = [
+        (p11, pA1, pB1),
+        (pA1 - p11, pA1, 1 - pB1),
+        (pB1 - p11, 1 - pA1, pB1),
+        (1 - pA1 - pB1 + p11, 1 - pA1, 1 - pB1),
+    ]
+    mi = np.zeros_like(p11)
+    second_moment = np.zeros_like(p11)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for p, q, r in cells:
+            log_ratio = np.where(p > 0, np.log(p / (q * r)), 0.0)
+            mi += p * log_ratio
+            second_moment += p * log_ratio**2
+    se = np.sqrt(np.maximum(second_moment - mi**2, 0) / n)
+    return mi, se
+
+
+def monte_carlo_mi(
+    spe,
+    configs,
+    cols,
+    samples,
+    seed=1,
+    workers=1,
+    chunk_size=1000,
+    model_path=None,
+):
+    """Estimate the MI of all pairs of `cols` from `samples` joint samples.
+    Returns nested dicts of the MI estimates and their standard errors. With
+    more than one worker, `model_path` has to be the path of the file `spe`
+    was loaded from."""
+    chunks = [
+        (i, min(chunk_size, samples - start))
+        for i, start in enumerate(range(0, samples, chunk_size))
+    ]
+    configs = {c: configs[c] for c in cols}
+    counts = np.zeros((len(cols), len(cols)))
+    if workers <= 1 or len(chunks) <= 1:
+        init_sampler(spe, cols, configs, seed)
+        for chunk in chunks:
+            counts += chunk_counts(chunk)
+    else:
+        assert model_path is not None, "Workers need the path of the model."
+        initargs = (model_path, cols, configs, seed)
+        with multiprocessing.Pool(
+            processes=min(workers, len(chunks)),
+            initializer=init_sampler,
+            initargs=initargs,
+        ) as pool:
+            for chunk in pool.imap_unordered(chunk_counts, chunks):
+                counts += chunk
+    mi, se = mi_from_counts(counts, samples)
+
+    def nested(matrix):
+        # Both directions of a pair get the value of the upper triangle.
+        return {
+            c1: {
+                c2: float(matrix[min(i, j), max(i, j)])
+                for j, c2 in enumerate(cols)
+                if j != i
+            }
+            for i, c1 in enumerate(cols)
+        }
+
+    return nested(mi), nested(se)
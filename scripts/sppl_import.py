@@ -86,6 +86,26 @@ def convert_view(view_index, view):
     return SumSPE(products, log_weights) if len(products) > 1 else products[0]
 
 
+def convert_model(views, max_number_of_views):
+    """Combine the converted views of a model into a Product of Sums."""
+    # We need to add dummy latent variables for view-clusterings in case other
+    # models in the ensemble have more views than the current one.
+    # Otherwise, the leaf nodes of the individual models differ; which, in the sppl-merge stage,
+    # will cause SPPL to throw an error.
+    views = list(views)
+    current_number_views = len(views)
+    for view_index in range(len(views), max_number_of_views):
+        views.append(
+            Identity(f"view_{view_index}_cluster")
+            >> distributions.choice(
+                {f"Unused -- model has only {current_number_views} views": 1}
+            )
+        )
+
+    # Construct a Product of Sums (or a single Sum).
+    return ProductSPE(views) if len(views) > 1 else views[0]
+
+
 def main():
     description = ""
     parser = argparse.ArgumentParser(description=description)
@@ -122,22 +142,8 @@ def main():
             multi_mix_ast[Keyword("multimixture/views")]
         )
     ]
-    # We need to add dummy latent variables for view-clusterings in case other
-    # models in the ensemble have more views than the current one.
-    # Otherwise, the leaf nodes of the individual models differ; which, in the sppl-merge stage,
-    # will cause SPPL to throw an error.
     max_number_of_views = int(args.max_number_views.read())
-    current_number_views = len(views)
-    for view_index in range(len(views), max_number_of_views):
-        views.append(
-            Identity(f"view_{view_index}_cluster")
-            >> distributions.choice(
-                {f"Unused -- model has only {current_number_views} views": 1}
-            )
-        )
-
-    # Construct a Product of Sums (or a single Sum).
-    spe = ProductSPE(views) if len(views) > 1 else views[0]
+    spe = convert_model(views, max_number_of_views)
     json.dump(spe_to_dict.spe_to_dict(spe), args.output)
 
 
@@ -13,7 +13,7 @@ if not hasattr(stats, "frechet_l"):
 
 import argparse
 import json
-import sppl.compilers.spe_to_dict as spe_to_dict
+import spe_dag
 import sppl.distributions as distributions
 
 from fractions import Fraction
@@ -40,6 +40,12 @@ def main():
         help="Path to write joined SPPL model JSON.",
         default=sys.stdout,
     )
+    parser.add_argument(
+        "--dag",
+        type=argparse.FileType("w"),
+        default=None,
+        help="Also write the joined model as a DAG in which identical subtrees are stored once (see spe_dag.py).",
+    )
 
     args = parser.parse_args()
 
@@ -47,8 +53,12 @@ def main():
         parser.print_help(sys.stderr)
         sys.exit(1)
 
-    spe_dicts = [json.load(model) for model in args.models]
-    children = [spe_to_dict.spe_from_dict(d) for d in spe_dicts]
+    # Hash-cons the models so that identical subtrees across models (e.g. the
+    # padding leaves added by sppl_import.py) are built once and shared.
+    table = spe_dag.NodeTable()
+    roots = [table.intern(json.load(model)) for model in args.models]
+    spes = spe_dag.build(table.nodes)
+    children = [spes[root] for root in roots]
 
     # Create an equal-weighted ExposedSum.
     id_children = Identity("child")
@@ -63,7 +73,11 @@ def main():
     spe = spe_sum if n_children > 1 else spe_sum.children[0]
     spe.child = id_children
 
-    json.dump(spe_to_dict.spe_to_dict(spe), args.output)
+    spe_dict = spe_dag.spe_to_tree(spe)
+    json.dump(spe_dict, args.output)
+    if args.dag is not None:
+        table = spe_dag.NodeTable()
+        json.dump(table.to_dag(table.intern(spe_dict)), args.dag)
 
 
 if __name__ == "__main__":
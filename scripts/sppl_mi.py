@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
-import itertools
 import numpy as np
+import os
 import pandas as pd
 import scipy.stats as stats
 import sys
@@ -9,9 +9,11 @@ import csv
 import yaml
 import argparse
 import json
-import edn_format
-import sppl.compilers.spe_to_dict as spe_to_dict
-from sppl.transforms import Identity as I
+from edn_cache import load_edn
+from pickle_cache import file_path
+from spe_cache import load_spe
+from spe_mi import iter_pairwise_mi
+from spe_mi import monte_carlo_mi
 
 if not hasattr(stats, "frechet_r"):
     stats.frechet_r = stats.weibull_max
@@ -20,11 +22,27 @@ if not hasattr(stats, "frechet_l"):
     stats.frechet_l = stats.weibull_min
 
 
-def get_predicate(c, v):
-    if isinstance(v, list):
-        return I(c) << set(v)
-    elif isinstance(v, float):
-        return I(c) > v
+def read_partial(path, header):
+    """Return the MI of the pairs in the partial results file `path`, a JSON
+    line with `header` followed by one [c1, c2, mi] line per pair. Results
+    written for another header are discarded, as is a truncated last line."""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        lines = f.read().split("\n")
+    try:
+        if json.loads(lines[0]) != header:
+            return done
+    except ValueError:
+        return done
+    for line in lines[1:]:
+        try:
+            c1, c2, value = json.loads(line)
+        except ValueError:
+            break
+        done[(c1, c2)] = value
+    return done
 
 
 def main():
@@ -34,7 +52,7 @@ def main():
     parser.add_argument(
         "--model",
         type=argparse.FileType("r"),
-        help="Path to SPE model (json) used to generate samples.",
+        help="Path to SPE model (json, tree or DAG) used to generate samples.",
     )
     parser.add_argument(
         "--mapping-table",
@@ -53,12 +71,38 @@ def main():
         default=sys.stdout,
     )
     parser.add_argument("--seed", type=int, default=1, help="CGPM seed.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes. Defaults to the number of CPUs.",
+        metavar="NUM",
+    )
+    parser.add_argument(
+        "--estimator",
+        choices=["exact", "monte-carlo"],
+        default="exact",
+        help="Compute the MI exactly, or estimate it from --samples joint samples and report standard errors.",
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=10000,
+        help="Number of joint samples used by the Monte Carlo estimator.",
+        metavar="NUM",
+    )
+    parser.add_argument(
+        "--partial",
+        type=str,
+        default=None,
+        help="Append the MI of every pair to this file as it is computed, and resume from it (exact estimator only).",
+        metavar="PATH",
+    )
 
     args = parser.parse_args()
-    spe_dict = json.load(args.model)
-    spe = spe_to_dict.spe_from_dict(spe_dict)
+    spe = load_spe(args.model)
     np.random.seed(args.seed)
-    mapping_table = edn_format.loads(args.mapping_table.read(), write_ply_tables=False)
+    mapping_table = load_edn(args.mapping_table)
     df = pd.read_csv(args.data)
     with open("params.yaml", "r") as stream:
         params = yaml.safe_load(stream)
@@ -68,10 +112,12 @@ def main():
         # Set default value.
         configs = {}
 
+    # Skip the cluster indices and the ensemble member ("child", see
+    # sppl_merge.py), which aren't columns of the data.
     cols = [
         k.__str__()
         for k in spe.sample(1)[0].keys()
-        if not k.__str__().endswith("_cluster")
+        if not k.__str__().endswith("_cluster") and k.__str__() != "child"
     ]
     cols.sort()
 
@@ -90,18 +136,58 @@ def main():
                 configs[c] = config
             else:
                 configs[c] = df[c].median()
-    pairs = list(itertools.combinations(cols, 2))
-    result = {"mi": {c: {} for c in cols}}
 
     # Switch back to provided random seed when doing MI calculations.
     np.random.seed(args.seed)
-    for c1, c2 in pairs:
-        p1 = get_predicate(c1, configs[c1])
-        p2 = get_predicate(c2, configs[c2])
-        mi = spe.mutual_information(p1, p2)
-        result["mi"][c1][c2] = mi
-        result["mi"][c2][c1] = mi
-    result["configs"] = configs
+    workers = args.workers or os.cpu_count()
+    # Workers load the model from its file, see spe_cache.py.
+    model_path = file_path(args.model)
+    if model_path is None:
+        workers = 1
+    if args.estimator == "monte-carlo":
+        mi, se = monte_carlo_mi(
+            spe,
+            configs,
+            cols,
+            args.samples,
+            seed=args.seed,
+            workers=workers,
+            model_path=model_path,
+        )
+        result = {"mi": mi, "configs": configs, "se": se, "samples": args.samples}
+        json.dump(result, args.output, indent=4)
+        return
+
+    header = {"columns": cols, "configs": configs, "seed": args.seed}
+    done = read_partial(args.partial, header) if args.partial else {}
+    partial = open(args.partial, "w") if args.partial else None
+    if partial is not None:
+        for line in [header] + [[c1, c2, mi] for (c1, c2), mi in done.items()]:
+            partial.write(json.dumps(line) + "\n")
+        partial.flush()
+
+    values = {}
+    for (c1, c2), value in done.items():
+        values[(c1, c2)] = values[(c2, c1)] = value
+    for c1, c2, value in iter_pairwise_mi(
+        spe,
+        configs,
+        cols,
+        seed=args.seed,
+        workers=workers,
+        skip=done,
+        model_path=model_path,
+    ):
+        values[(c1, c2)] = values[(c2, c1)] = value
+        if partial is not None:
+            partial.write(json.dumps([c1, c2, value]) + "\n")
+            partial.flush()
+    if partial is not None:
+        partial.close()
+
+    # Pairs complete in any order, so order the output by column.
+    mi = {c1: {c2: values[(c1, c2)] for c2 in cols if c2 != c1} for c1 in cols}
+    result = {"mi": mi, "configs": configs}
     json.dump(result, args.output, indent=4)
 
 
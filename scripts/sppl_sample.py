@@ -13,17 +13,110 @@ if not hasattr(stats, "frechet_l"):
     stats.frechet_l = stats.weibull_min
 
 import argparse
-import json
-import sppl.compilers.spe_to_dict as spe_to_dict
+import multiprocessing
+import numpy as np
+import os
+from pickle_cache import file_path
+from spe_cache import load_spe
+from spe_cache import load_spe_path
 from sppl.transforms import Identity
 
+# Samples are drawn in chunks of `--chunk-size` rows by a pool of worker
+# processes. Chunk i is drawn with its own PRNG seeded with (seed, i), so the
+# output only depends on the seed and the chunk size, not on the number of
+# workers. Chunks are written in order as they complete, so memory is bounded
+# by the chunks in flight rather than by the number of samples.
 
-def generate(spe, columns, N):
-    spe_samples = spe.sample_subset(N, columns)
-    sample_df = pd.DataFrame(
-        [{str(k): v for k, v in row.items()} for row in spe_samples]
+# The model and columns are set once per worker by `init_worker` so that they
+# don't have to be sent with every chunk. SPEs can't be sent to worker
+# processes (see spe_cache.py), so workers are given the path of the model and
+# the column names, and load the model from the cache themselves.
+_worker_state = {}
+
+
+def init_worker(model, columns, seed, output_format):
+    """Set up a worker. `model` is an SPE or the path of a model file."""
+    spe = load_spe_path(model) if isinstance(model, str) else model
+    _worker_state.update(
+        spe=spe,
+        columns=[Identity(c) for c in columns],
+        seed=seed,
+        output_format=output_format,
     )
-    return sample_df
+
+
+def chunk_prng(seed, i):
+    return np.random.RandomState(np.random.SeedSequence([seed, i]).generate_state(4))
+
+
+def generate(spe, columns, N, prng=None):
+    """Return `N` samples of the symbols `columns` as a DataFrame."""
+    spe_samples = spe.sample_subset(columns, N, prng=prng)
+    return pd.DataFrame({str(c): [row[c] for row in spe_samples] for c in columns})
+
+
+def sample_chunk(chunk):
+    """Draw chunk `i` of `n` rows. CSV chunks are formatted in the worker."""
+    i, n = chunk
+    state = _worker_state
+    samples = generate(state["spe"], state["columns"], n, chunk_prng(state["seed"], i))
+    if state["output_format"] == "csv":
+        return samples.to_csv(index=False, header=False)
+    return samples
+
+
+def chunks(sample_count, chunk_size):
+    return [
+        (i, min(chunk_size, sample_count - start))
+        for i, start in enumerate(range(0, sample_count, chunk_size))
+    ]
+
+
+def sample_chunks(model, columns, jobs, seed, output_format, workers=1):
+    """Yield the chunks `jobs` (see `chunks`) of samples of `columns` in order.
+    With more than one worker, `model` has to be the path of the model file."""
+    initargs = (model, columns, seed, output_format)
+    if workers <= 1:
+        init_worker(*initargs)
+        yield from map(sample_chunk, jobs)
+        return
+    assert isinstance(model, str), "Workers need the path of the model."
+    with multiprocessing.Pool(
+        processes=workers, initializer=init_worker, initargs=initargs
+    ) as pool:
+        yield from pool.imap(sample_chunk, jobs)
+
+
+class CSVWriter:
+    def __init__(self, f, columns):
+        self.f = f
+        self.f.write(pd.DataFrame(columns=columns).to_csv(index=False))
+
+    def write(self, chunk):
+        self.f.write(chunk)
+
+    def close(self):
+        self.f.flush()
+
+
+class ParquetWriter:
+    def __init__(self, f):
+        import pyarrow.parquet
+
+        self.pyarrow = pyarrow
+        self.f = f.buffer
+        self.writer = None
+
+    def write(self, chunk):
+        table = self.pyarrow.Table.from_pandas(chunk, preserve_index=False)
+        if self.writer is None:
+            self.writer = self.pyarrow.parquet.ParquetWriter(self.f, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.f.flush()
 
 
 def main():
@@ -33,7 +126,7 @@ def main():
     parser.add_argument(
         "--model",
         type=argparse.FileType("r"),
-        help="Path to SPE model (json) used to generate samples.",
+        help="Path to SPE model (json, tree or DAG) used to generate samples.",
     )
     parser.add_argument(
         "--data",
@@ -51,21 +144,60 @@ def main():
         "-o",
         "--output",
         type=argparse.FileType("w+"),
-        help="Path to which samples will be written as EDN.",
+        help="Path to which samples will be written.",
         default=sys.stdout,
     )
+    parser.add_argument(
+        "--format",
+        choices=["csv", "parquet"],
+        default="csv",
+        help="Output format. Parquet requires pyarrow.",
+        dest="output_format",
+    )
+    parser.add_argument("--seed", type=int, default=1, help="Sampling seed.")
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=10000,
+        help="Number of samples drawn per chunk.",
+        metavar="NUM",
+        dest="chunk_size",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes. Defaults to the number of CPUs.",
+        metavar="NUM",
+    )
 
     args = parser.parse_args()
-    spe_dict = json.load(args.model)
-    spe = spe_to_dict.spe_from_dict(spe_dict)
+    spe = load_spe(args.model)
 
     data = pd.read_csv(args.data)
-    row_count = len(data)
+    columns = data.columns.tolist()
+    sample_count = args.sample_count or len(data)
+
+    if args.output_format == "parquet":
+        try:
+            writer = ParquetWriter(args.output)
+        except ImportError:
+            parser.error("--format parquet requires pyarrow.")
+    else:
+        writer = CSVWriter(args.output, columns)
 
-    sample_count = args.sample_count or row_count
-    columns = [Identity(c) for c in data.columns]
-    samples = generate(spe, sample_count, columns)
-    samples.to_csv(args.output, index=False)
+    jobs = chunks(sample_count, args.chunk_size)
+    workers = min(args.workers or os.cpu_count(), len(jobs))
+    model_path = file_path(args.model)
+    if model_path is None:
+        # A model read from stdin can't be loaded again by the workers.
+        workers = 1
+    model = spe if workers <= 1 else model_path
+    for chunk in sample_chunks(
+        model, columns, jobs, args.seed, args.output_format, workers
+    ):
+        writer.write(chunk)
+    writer.close()
 
 
 if __name__ == "__main__":
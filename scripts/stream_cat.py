@@ -5,7 +5,8 @@ import numpy as np
 from cgpm.crosscat.state import State
 from cgpm.utils import general as gu
 
-from cgpm_infer import replace
+from checkpoint_archive import ArchiveWriter
+from cgpm_model import write_metadata
 
 
 class Streamcat:
@@ -14,14 +15,22 @@ class Streamcat:
 
     def __init__(self, X, col_names, incorporated, incorporated_rows, seed, **kwargs):
         self.col_names = col_names
+        self.col_index = {col_name: i for i, col_name in enumerate(col_names)}
         self.outputs = range(len(col_names))
-        self.incorporated_cols = incorporated
+        self.incorporated_cols = list(incorporated)
         self.incorporated_rows = incorporated_rows
         self.distargs = kwargs.get("distargs_orig_order", None)
         self.cctypes = kwargs.get("cctypes_orig_order", None)
         self.X = X
         self.T = X.shape[0]
         self.counter = 0
+        # Checkpoints are written as JSON ("json") or CGPM archives ("npz"), one
+        # file per checkpoint, or appended to one checkpoint archive ("ckpt").
+        self.checkpoint_format = kwargs.get("checkpoint_format", "json")
+        # Optional CheckpointWriter; checkpoints are written synchronously
+        # without one.
+        self.checkpoint_writer = None
+        self.checkpoint_archive = None
         # TODO: add switch for  checkpointing.
         # Initialize a CGPM-CrossCat state with a subset of rows and cols.
         init_state_args = kwargs
@@ -56,6 +65,7 @@ class Streamcat:
             outputs=metadata.get("outputs", None),
             cctypes_orig_order=metadata.get("cctypes_orig_order", None),
             distargs_orig_order=metadata.get("distargs_orig_order", None),
+            checkpoint_format=metadata.get("checkpoint_format", "json"),
             alpha=metadata.get("alpha", None),
             Zv=to_dict(metadata.get("Zv", None)),
             Zrv=to_dict(metadata.get("Zrv", None)),
@@ -79,38 +89,53 @@ class Streamcat:
         metadata["seed"] = self.seed
         return metadata
 
-    def safe_incorporate_row(self, t):
+    def safe_incorporate_row(self, t, weighted=False):
         """Safely incorporate a partial row.
         "Partial" refers to all already incorporated columns in row index t.
 
         We use t as row index because of SMC conventions.
 
-        For SMC, this will need to return a weight (currently stubbed)."""
-        self.state.incorporate(
-            t,
-            {
-                self.incorporated_cols.index(col_name): self.X[
-                    t, self.col_names.index(col_name)
-                ]
-                for col_name in self.incorporated_cols
-                if ~np.isnan(self.X[t, self.col_names.index(col_name)])
-            },
-        )
-        self.incorporated_rows += 1
-        # This is a stub. For SMC, we need to return a real weight here.
-        return 0.0
+        Returns the log weight of the row for SMC (see
+        `safe_incorporate_rows`)."""
+        return self.safe_incorporate_rows([t], weighted=weighted)[0]
+
+    def safe_incorporate_rows(self, rows, weighted=False):
+        """Safely incorporate a block of partial rows.
+
+        Returns one log weight per row. With `weighted`, the weight of a row is
+        its log predictive density under the state right before it is
+        incorporated, which is the incremental importance weight for SMC.
+        Otherwise the weights aren't computed and are returned as 0.0."""
+        rows = np.asarray(rows)
+        stream_cids = [self.col_index[col_name] for col_name in self.incorporated_cols]
+        block = self.X[np.ix_(rows, stream_cids)]
+        observed = ~np.isnan(block)
+        log_weights = []
+        for t, values, mask in zip(rows, block, observed):
+            row = {int(cid): values[cid] for cid in np.flatnonzero(mask)}
+            if weighted and row:
+                log_weights.append(self.state.logpdf(-1, row))
+            else:
+                log_weights.append(0.0)
+            self.state.incorporate(int(t), row)
+        self.incorporated_rows += len(rows)
+        return log_weights
 
     def safe_incorporate_col(self, col_name):
         """Safely incorporate a partial column.
         "Partial" refers to all already incorporated rows.
 
-        For SMC, this will need to return a weight (currently stubbed)."""
+        Returns None if the column has no observed values yet. Otherwise returns
+        the column's log weight for SMC: the change in the state's joint log
+        score, i.e. the log marginal likelihood of the column's data under the
+        view it was incorporated into."""
         state_cid = len(self.incorporated_cols)
-        stream_cid = self.col_names.index(col_name)
+        stream_cid = self.col_index[col_name]
         col_data = self.X[0 : self.incorporated_rows, stream_cid]
         if np.all(np.isnan(col_data)):
             return None
         else:
+            logpdf_score = self.state.logpdf_score()
             self.state.incorporate_dim(
                 col_data.tolist(),
                 [state_cid],
@@ -118,8 +143,7 @@ class Streamcat:
                 distargs=self.distargs[stream_cid],
             )
             self.incorporated_cols.append(col_name)
-            # This is a stub. For SMC, we need to return a real weight here.
-            return 0.0
+            return self.state.logpdf_score() - logpdf_score
 
     def transition(self, N):
         self.state.transition(N=N, progress=False)
@@ -147,10 +171,17 @@ class Streamcat:
         self.state.transition_view_alphas()
         self.state.transition_dim_hypers()
 
-    def insert_rows(self, rows, save_checkpoint=False):
-        for row in rows:
-            self.safe_incorporate_row(row)
-            self.transition_rows([row], save_checkpoint=save_checkpoint)
+    def insert_rows(self, rows, save_checkpoint=False, block_size=1, weighted=False):
+        """Incorporate rows in blocks of `block_size` rows, running one row and
+        hyperparameter transition per block. Returns the summed log weight of
+        the rows (see `safe_incorporate_rows`)."""
+        rows = list(rows)
+        log_weight = 0.0
+        for i in range(0, len(rows), block_size):
+            block = rows[i : i + block_size]
+            log_weight += sum(self.safe_incorporate_rows(block, weighted=weighted))
+            self.transition_rows(block, save_checkpoint=save_checkpoint)
+        return log_weight
 
     def insert_cols(self, cols, save_checkpoint=False):
         for col in cols:
@@ -164,20 +195,72 @@ class Streamcat:
     def random_other_col(self):
         return self.rng.choice(self.other_cols())
 
+    def summary(self):
+        """Return a lightweight summary of the current state: the log score,
+        the view of every incorporated column (two columns are dependent iff
+        they share a view, so this is the co-assignment matrix in compact form)
+        and the number of clusters in every view."""
+        Zv = self.state.Zv()
+        return {
+            "seed": self.seed,
+            "rows": self.incorporated_rows,
+            "logscore": self.state.logpdf_score(),
+            "columns": list(self.incorporated_cols),
+            "Zv": [Zv[cid] for cid in range(len(self.incorporated_cols))],
+            "views": len(self.state.views),
+            "clusters": {
+                v: len(set(view.Zr().values())) for v, view in self.state.views.items()
+            },
+        }
+
+    def snapshot(self):
+        """Return the latent state without the data. Particles are copied in
+        SMC by restoring another particle's snapshot, which is much cheaper to
+        send between processes than the full metadata."""
+        metadata = self.state.to_metadata()
+        del metadata["X"]
+        return {
+            "state": metadata,
+            "incorporated_cols": list(self.incorporated_cols),
+            "incorporated_rows": self.incorporated_rows,
+        }
+
+    def restore(self, snapshot):
+        """Replace the latent state with a snapshot of another particle. The
+        random number generator of this particle is kept."""
+        self.incorporated_cols = list(snapshot["incorporated_cols"])
+        self.incorporated_rows = snapshot["incorporated_rows"]
+        stream_cids = [self.col_index[col_name] for col_name in self.incorporated_cols]
+        metadata = dict(snapshot["state"])
+        metadata["X"] = self.X[: self.incorporated_rows][:, stream_cids]
+        self.state = State.from_metadata(metadata, rng=self.rng)
+
     def save_checkpoint(self):
         metadata = self.state.to_metadata()
         n, d = self.X.shape
         metadata["n"] = n
         metadata["d"] = d
-        metadata["col_names"] = self.incorporated_cols
-        metadata["X"] = replace(metadata["X"], math.isnan, None)
-        json.dump(
-            metadata,
-            open(
-                "data/cgpm/checkpoints/sample-{}/t-{}.json".format(
-                    self.seed, str(self.counter).zfill(8)
-                ),
-                "w",
-            ),
-        )
+        metadata["col_names"] = list(self.incorporated_cols)
+        if self.checkpoint_format == "ckpt":
+            path = "data/cgpm/checkpoints/sample-{}.ckpt".format(self.seed)
+        else:
+            path = "data/cgpm/checkpoints/sample-{}/t-{}.{}".format(
+                self.seed, str(self.counter).zfill(8), self.checkpoint_format
+            )
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.submit(metadata, path)
+        elif self.checkpoint_format == "ckpt":
+            # Kept open until `close`.
+            if self.checkpoint_archive is None:
+                self.checkpoint_archive = ArchiveWriter(path)
+            self.checkpoint_archive.append(metadata)
+        else:
+            write_metadata(metadata, path)
         self.counter += 1
+
+    def close(self):
+        """Close the checkpoint archive that checkpoints are appended to when
+        there is no checkpoint writer, which writes its index."""
+        if self.checkpoint_archive is not None:
+            self.checkpoint_archive.close()
+            self.checkpoint_archive = None
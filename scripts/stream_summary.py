@@ -0,0 +1,116 @@
+import json
+import socket
+import sys
+
+# Online summaries of a streaming chain. `SummaryHook` is passed to `inf_prog`
+# in `hooks` and writes `Streamcat.summary()` as one JSON line to a sink every
+# `every` incorporated rows and once more when inference is done. A sink is
+# either a file, which is appended to and flushed after every line so that
+# dashboards can tail it, or a local socket.
+
+
+class FileSink:
+    def __init__(self, path):
+        self.f = open(path, "a")
+
+    def write(self, line):
+        self.f.write(line)
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class SocketSink:
+    """Send lines to a TCP socket ("HOST:PORT") or a Unix domain socket
+    ("unix:PATH"). Summaries are best-effort: if the socket can't be reached
+    they are dropped instead of interrupting inference.
+
+    The socket is non-blocking so that a slow reader never stalls the chain.
+    A line that doesn't fit in the socket buffer is kept and sent on later
+    writes, and new lines are dropped until it has been sent. Only `close`
+    waits, for at most `close_timeout` seconds, to send the last line."""
+
+    def __init__(self, address, connect_timeout=1.0, close_timeout=1.0):
+        self.address = address
+        self.close_timeout = close_timeout
+        self.pending = b""
+        self.socket = None
+        try:
+            if address.startswith("unix:"):
+                self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.socket.settimeout(connect_timeout)
+                self.socket.connect(address[len("unix:") :])
+            else:
+                host, port = address.rsplit(":", 1)
+                self.socket = socket.create_connection(
+                    (host, int(port)), timeout=connect_timeout
+                )
+            self.socket.setblocking(False)
+        except OSError as e:
+            self.disconnect(e)
+
+    def disconnect(self, error):
+        print(
+            "Dropping summaries for {}: {}".format(self.address, error),
+            file=sys.stderr,
+        )
+        if self.socket is not None:
+            self.socket.close()
+        self.socket = None
+        self.pending = b""
+
+    def flush(self):
+        """Send as much of the pending line as the socket takes without
+        blocking."""
+        try:
+            while self.pending:
+                sent = self.socket.send(self.pending)
+                self.pending = self.pending[sent:]
+        except BlockingIOError:
+            pass
+        except OSError as e:
+            self.disconnect(e)
+
+    def write(self, line):
+        if self.socket is None:
+            return
+        self.flush()
+        if self.socket is not None and not self.pending:
+            self.pending = line.encode("utf-8")
+            self.flush()
+
+    def close(self):
+        if self.socket is None:
+            return
+        try:
+            self.socket.settimeout(self.close_timeout)
+            self.socket.sendall(self.pending)
+        except OSError as e:
+            self.disconnect(e)
+            return
+        self.socket.close()
+        self.socket = None
+
+
+def open_sink(target):
+    is_tcp = ":" in target and target.rsplit(":", 1)[1].isdigit()
+    if target.startswith("unix:") or is_tcp:
+        return SocketSink(target)
+    return FileSink(target)
+
+
+class SummaryHook:
+    """Write a summary of the model every `every` incorporated rows."""
+
+    def __init__(self, sink, every=10):
+        self.sink = sink
+        self.every = every
+        self.last = None
+
+    def __call__(self, model, done=False):
+        rows = model.incorporated_rows
+        if done or self.last is None or rows // self.every > self.last // self.every:
+            summary = dict(model.summary(), done=done)
+            self.sink.write(json.dumps(summary) + "\n")
+            self.last = rows
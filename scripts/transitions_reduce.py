@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import numpy as np
+import sys
+
+# Averages per-chain transitions files across chains. Every input file is a
+# JSON array with one entry per iteration (checkpoint), either a dep-prob map
+# {c1: {c2: p}} or an MI record {"configs": ..., "mi": {c1: {c2: mi}}}. The
+# output is a JSON array with the average over all chains at each iteration.
+# Inputs are aligned by iteration and truncated to the shortest chain, and they
+# are read one entry at a time, so memory doesn't grow with the number of
+# iterations.
+
+WHITESPACE = " \t\n\r"
+
+
+def iter_json_array(f, chunk_size=1 << 16):
+    """Yield the elements of the JSON array in the file object `f` one at a
+    time, without reading the whole file.
+
+    An element that isn't complete in the buffer is decoded again once more
+    has been read. Every read at least doubles the buffer, so that an element
+    of n characters is decoded O(log n) times, on O(n) characters in total."""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    eof = False
+
+    def fill():
+        nonlocal buffer, eof
+        chunk = f.read(max(chunk_size, len(buffer)))
+        eof = not chunk
+        buffer += chunk
+
+    def skip_whitespace():
+        nonlocal buffer
+        while True:
+            buffer = buffer.lstrip(WHITESPACE)
+            if buffer or eof:
+                return
+            fill()
+
+    skip_whitespace()
+    if not buffer.startswith("["):
+        raise ValueError("Expected a JSON array.")
+    buffer = buffer[1:]
+    skip_whitespace()
+    if buffer.startswith("]"):
+        return
+    while True:
+        try:
+            value, end = decoder.raw_decode(buffer)
+            # A value at the end of the buffer might be incomplete (e.g. a
+            # number), so only accept it if it is followed by a delimiter.
+            complete = buffer[end:].lstrip(WHITESPACE)[:1] in (",", "]")
+        except json.JSONDecodeError:
+            complete = False
+        if not complete:
+            if eof:
+                raise ValueError("Unexpected end of JSON array.")
+            fill()
+            continue
+        yield value
+        buffer = buffer[end:].lstrip(WHITESPACE)
+        if buffer.startswith("]"):
+            return
+        buffer = buffer[1:]
+        skip_whitespace()
+
+
+def average_maps(maps):
+    """Average nested {c1: {c2: value}} maps."""
+    averaged = {}
+    for c1, row in maps[0].items():
+        c2s = [c2 for c2 in row if c2 != c1]
+        values = np.array([[m[c1][c2] for c2 in c2s] for m in maps], dtype=float)
+        averaged[c1] = dict(zip(c2s, values.mean(axis=0).tolist()))
+    return averaged
+
+
+def reduce_iteration(entries):
+    if "mi" in entries[0]:
+        configs = entries[0]["configs"]
+        assert all(entry["configs"] == configs for entry in entries)
+        return {"configs": configs, "mi": average_maps([e["mi"] for e in entries])}
+    return average_maps(entries)
+
+
+def main():
+    description = "Averages per-chain dep-prob or MI transitions across chains."
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        nargs="+",
+        type=str,
+        help="Per-chain transitions JSON files.",
+        metavar="TRANSITIONS",
+        dest="transitions",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=argparse.FileType("w"),
+        help="Path to averaged transitions JSON.",
+        default=sys.stdout,
+    )
+    args = parser.parse_args()
+
+    files = [open(path, "r") for path in args.transitions]
+    try:
+        args.output.write("[")
+        iterations = zip(*[iter_json_array(f) for f in files])
+        for i, entries in enumerate(iterations):
+            if i > 0:
+                args.output.write(",\n")
+            json.dump(reduce_iteration(entries), args.output)
+        args.output.write("]\n")
+    finally:
+        for f in files:
+            f.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+(ns gensql.structure-learning.cgpm-archive
+  "Functions for reading CGPM archives: zip files holding a JSON header and the
+  arrays of a CGPM model as NumPy .npy files. See scripts/cgpm_model.py."
+  (:require [cheshire.core :as json]
+            [clojure.string :as string])
+  (:import [java.io DataInputStream InputStream]
+           [java.nio ByteBuffer ByteOrder]
+           [java.util.zip ZipFile]))
+
+(defn archive?
+  "Returns true if path points to a CGPM archive."
+  [path]
+  (string/ends-with? (str path) ".npz"))
+
+(defn ^:private little-endian-buffer
+  [^bytes bs]
+  (.order (ByteBuffer/wrap bs) ByteOrder/LITTLE_ENDIAN))
+
+(defn ^:private read-npy-header
+  "Reads the header of a .npy file and returns its dtype descriptor and shape."
+  [^DataInputStream in]
+  (let [magic (byte-array 6)
+        _ (.readFully in magic)
+        major-version (.readUnsignedByte in)
+        _minor-version (.readUnsignedByte in)
+        header-length (if (= 1 major-version)
+                        (let [bs (byte-array 2)]
+                          (.readFully in bs)
+                          (bit-and 0xffff (.getShort (little-endian-buffer bs))))
+                        (let [bs (byte-array 4)]
+                          (.readFully in bs)
+                          (.getInt (little-endian-buffer bs))))
+        header-bytes (byte-array header-length)
+        _ (.readFully in header-bytes)
+        header (String. header-bytes "ISO-8859-1")]
+    {:descr (second (re-find #"'descr':\s*'([^']*)'" header))
+     :fortran-order (some? (re-find #"'fortran_order':\s*True" header))
+     :shape (->> (re-find #"'shape':\s*\(([^)]*)\)" header)
+                 (second)
+                 (re-seq #"\d+")
+                 (mapv parse-long))}))
+
+(defn ^:private read-int-matrix
+  "Reads a two-dimensional little-endian int32 .npy array as a vector of
+  vectors."
+  [^InputStream stream]
+  (let [in (DataInputStream. stream)
+        {:keys [descr fortran-order shape]} (read-npy-header in)]
+    (assert (= "<i4" descr) (str "Unsupported dtype: " descr))
+    (assert (not fortran-order) "Fortran-ordered arrays are not supported.")
+    (if (not= 2 (count shape))
+      []
+      (let [[n-rows n-cols] shape
+            bs (byte-array (* 4 n-rows n-cols))
+            _ (.readFully in bs)
+            ints (.asIntBuffer (little-endian-buffer bs))]
+        (mapv (fn [i]
+                (let [row (int-array n-cols)]
+                  (.get ints row)
+                  (vec row)))
+              (range n-rows))))))
+
+(defn read-cgpm
+  "Reads the CGPM model in a CGPM archive. The data matrix is not read; its
+  number of rows is available as :n_rows. :Zrv is returned as a sequence of
+  view/assignments pairs, just like in CGPM's JSON export."
+  [path]
+  (with-open [zip (ZipFile. (str path))]
+    (let [header (with-open [stream (.getInputStream zip (.getEntry zip "header.json"))]
+                   (json/parse-string (slurp stream) true))
+          zrv-entry (.getEntry zip "Zrv.npy")
+          zrv (when zrv-entry
+                (with-open [stream (.getInputStream zip zrv-entry)]
+                  (read-int-matrix stream)))]
+      (cond-> (dissoc header :Zrv_views)
+        zrv-entry (assoc :Zrv (map vector (:Zrv_views header) zrv))))))
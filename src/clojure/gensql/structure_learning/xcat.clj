@@ -5,6 +5,7 @@
             [clojure.data.csv :as csv]
             [clojure.edn :as edn]
             [medley.core :as medley]
+            [gensql.structure-learning.cgpm-archive :as cgpm-archive]
             [gensql.structure-learning.csv :as am.csv]
             [gensql.inference.gpm.crosscat :as xcat]))
 
@@ -99,18 +100,26 @@
 (defn xcat-model
   "Returns a XCat record given a CGPM model and other necessary items."
   [cgpm-model schema mapping-table csv-data numericalized]
-  (let [data (data csv-data schema (-> cgpm-model :X count))
+  (let [data (data csv-data schema (or (:n_rows cgpm-model)
+                                      (-> cgpm-model :X count)))
         spec (spec numericalized schema cgpm-model)
         latents (latents cgpm-model)
         options (options mapping-table)]
     (xcat/construct-xcat-from-latents spec latents data {:options options})))
 
+(defn read-cgpm
+  "Reads a CGPM model from either a JSON file or a CGPM archive."
+  [path]
+  (if (cgpm-archive/archive? path)
+    (cgpm-archive/read-cgpm path)
+    (-> path (str) (slurp) (json/parse-string true))))
+
 (defn import
-  "Imports a CGPM model (json) and prints it out as an XCat record (edn)."
+  "Imports a CGPM model (json or CGPM archive) and prints it out as an XCat record (edn)."
   [{:keys [cgpm-json data-csv mapping-table numericalized-csv schema-edn]}]
   (let [schema        (-> schema-edn        (str) (slurp) (edn/read-string))
         mapping-table (-> mapping-table     (str) (slurp) (edn/read-string))
         csv-data      (-> data-csv          (str) (slurp) (csv/read-csv))
         numericalized (-> numericalized-csv (str) (slurp) (csv/read-csv))
-        cgpm-model    (-> cgpm-json         (str) (slurp) (json/parse-string true) (fix-cgpm-maps))]
+        cgpm-model    (-> cgpm-json         (read-cgpm) (fix-cgpm-maps))]
     (prn (xcat-model cgpm-model schema mapping-table csv-data numericalized))))
@@ -0,0 +1,90 @@
+import edn_format
+import io
+import pytest
+import sys
+
+sys.path.insert(0, "scripts")
+
+from ast_export import export_view
+from ast_export import prune_views
+from ast_export import view_clusters
+from ast_export import write_edn
+
+K = edn_format.Keyword
+
+METADATA_VIEW = {
+    "outputs": [0, 1],
+    "cctypes": {0: "normal", 1: "categorical"},
+    "hypers": {0: {"m": 0.0, "r": 1.0, "s": 1.0, "nu": 1.0}, 1: {"alpha": 1.0}},
+    "distargs": {0: None, 1: {"k": 2}},
+    "suffstats": [
+        {
+            0: {"N": 2, "sum_x": 2.0, "sum_x_sq": 2.0},
+            1: {"N": 0, "sum_x": 0.0, "sum_x_sq": 0.0},
+        },
+        {0: {"N": 2, "counts": [2, 0]}, 1: {"N": 0, "counts": [0, 0]}},
+    ],
+    "Zr": [0, 0],
+    "alpha": 2.0,
+}
+
+
+def test_export_view():
+    view = export_view(METADATA_VIEW, {1: {0: "yes", 1: "no"}}, {0: "x", 1: "y"})
+    f = io.StringIO()
+    write_edn([view], f)
+    ast = edn_format.loads(f.getvalue())
+    (view,) = ast[K("multimixture/views")]
+    clusters = view[K("view/clusters")]
+    assert [c[K("cluster/weight")] for c in clusters] == [0.5, 0.5]
+    x = clusters[0][K("cluster/column->distribution")]["x"]
+    assert x[K("distribution/type")] == K("distribution.type/student-t")
+    assert x[K("student-t/degrees-of-freedom")] == 3.0
+    assert x[K("student-t/location")] == pytest.approx(2.0 / 3.0)
+    y = clusters[1][K("cluster/column->distribution")]["y"]
+    assert dict(y[K("categorical/category->weight")]) == {"yes": 0.5, "no": 0.5}
+
+
+def test_prune_views():
+    metadata_view = dict(METADATA_VIEW, Zr=[0] * 99, alpha=1.0)
+    view = export_view(metadata_view, None, {0: "x", 1: "y"})
+    (pruned,), report = prune_views([view], 0.05)
+    assert pruned["weights"].tolist() == [1.0]
+    assert (
+        len(pruned["distributions"][1]["params"]["categorical/category->weight"]) == 1
+    )
+    assert report["views"][0]["kept"] == 1
+    assert report["tv_bound"] == pytest.approx(0.01)
+
+
+def test_export_crp_view():
+    metadata_view = {
+        "outputs": [0],
+        "cctypes": {0: "crp"},
+        "hypers": {0: {"alpha": 1.0}},
+        "distargs": {0: None},
+        "suffstats": [
+            {
+                0: {"N": 2, "counts": {0: 1, 1: 1}},
+                1: {"N": 1, "counts": {0: 1}},
+                2: {"N": 0, "counts": {0: 0}},
+            },
+        ],
+        "Zr": [0, 0, 1],
+        "alpha": 1.0,
+    }
+    view = export_view(metadata_view, None, {0: "z"})
+    f = io.StringIO()
+    write_edn([view], f)
+    (edn_view,) = edn_format.loads(f.getvalue())[K("multimixture/views")]
+    for clusters in [edn_view[K("view/clusters")], view_clusters(view)]:
+        weights = [
+            dict(
+                c[K("cluster/column->distribution")]["z"][
+                    K("categorical/category->weight")
+                ]
+            )
+            for c in clusters
+        ]
+        assert weights[0] == pytest.approx({"0": 1 / 3, "1": 1 / 3, "2": 1 / 3})
+        assert weights[1] == pytest.approx({"0": 0.5, "1": 0.5})
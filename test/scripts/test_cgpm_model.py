@@ -0,0 +1,48 @@
+import math
+import numpy as np
+import pytest
+import sys
+
+sys.path.insert(0, "scripts")
+
+from cgpm_model import read_metadata
+from cgpm_model import write_metadata
+
+METADATA = {
+    "X": [[1.0, math.nan], [2.0, 0.0], [math.nan, 1.0]],
+    "outputs": [0, 1],
+    "cctypes": ["normal", "categorical"],
+    "Zv": [[0, 0], [1, 3]],
+    "Zrv": [[0, [0, 0, 1]], [3, [2, 0, 2]]],
+    "view_alphas": [[0, 1.5], [3, 0.5]],
+    "suffstats": [{"0": {"N": 2}}, {"0": {"N": 1}}],
+    "alpha": 1.0,
+    "hooked_cgpms": {},
+}
+
+
+@pytest.mark.parametrize("extension", ["json", "npz"])
+def test_round_trip(tmp_path, extension):
+    path = str(tmp_path / f"sample.0.{extension}")
+    write_metadata(METADATA, path)
+    metadata = read_metadata(path)
+    np.testing.assert_array_equal(np.asarray(metadata["X"]), METADATA["X"])
+    assert metadata["Zrv"] == METADATA["Zrv"]
+    for k in ["outputs", "cctypes", "Zv", "view_alphas", "suffstats", "alpha"]:
+        assert metadata[k] == METADATA[k]
+
+
+@pytest.mark.parametrize("extension", ["json", "npz"])
+def test_skip_arrays(tmp_path, extension):
+    path = str(tmp_path / f"sample.0.{extension}")
+    write_metadata(METADATA, path)
+    metadata = read_metadata(path, arrays=())
+    assert "X" not in metadata
+    assert "Zrv" not in metadata
+    assert metadata["Zv"] == METADATA["Zv"]
+
+
+def test_archive_records_number_of_rows(tmp_path):
+    path = str(tmp_path / "sample.0.npz")
+    write_metadata(METADATA, path)
+    assert read_metadata(path, arrays=())["n_rows"] == 3
@@ -0,0 +1,75 @@
+import math
+import numpy as np
+import sys
+
+sys.path.insert(0, "scripts")
+
+from checkpoint_archive import ArchiveWriter
+from checkpoint_archive import CheckpointArchive
+from checkpoint_archive import normalize
+
+
+def checkpoints(n):
+    rng = np.random.RandomState(0)
+    for t in range(n):
+        X = rng.normal(size=(t + 3, 2))
+        X[0, 1] = math.nan
+        yield {
+            "X": X.tolist(),
+            "Zv": [[0, 0], [1, t % 2]],
+            "Zrv": [[0, rng.randint(3, size=t + 3).tolist()]]
+            + ([[1, [0] * (t + 3)]] if t % 2 else []),
+            "alpha": float(t),
+            "hooked_cgpms": {},
+        }
+
+
+def assert_same(metadata, expected):
+    np.testing.assert_array_equal(np.asarray(metadata["X"]), expected["X"])
+    for k in ["Zv", "Zrv", "alpha", "hooked_cgpms"]:
+        assert metadata[k] == expected[k]
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "sample-0.ckpt")
+    expected = list(checkpoints(12))
+    with ArchiveWriter(path, keyframe_every=5) as writer:
+        for metadata in expected:
+            writer.append(metadata)
+    with CheckpointArchive(path) as archive:
+        assert len(archive) == len(expected)
+        for metadata, e in zip(archive, expected):
+            assert_same(metadata, e)
+        for i in [11, 0, 7, 8, 9, 3, -1, 2]:
+            assert_same(archive[i], expected[i])
+
+
+def test_unclosed_archive(tmp_path):
+    path = str(tmp_path / "sample-0.ckpt")
+    expected = list(checkpoints(4))
+    writer = ArchiveWriter(path, keyframe_every=3)
+    for metadata in expected:
+        writer.append(metadata)
+    with CheckpointArchive(path, arrays=("Zrv",)) as archive:
+        assert len(archive) == len(expected)
+        assert "X" not in archive[3]
+        assert archive[3]["Zrv"] == expected[3]["Zrv"]
+
+
+def test_normalize_matches_json_round_trip():
+    X = np.array([[1.0, math.nan], [2.0, 3.0]])
+    metadata = {
+        "X": X,
+        "Zv": [(0, 0), (1, np.int64(1))],
+        "Zrv": [[0, np.array([0, 1], dtype=np.int32)]],
+        "hypers": [{"alpha": np.float64(0.5)}],
+        "hooked_cgpms": {1: (2.0, None)},
+    }
+    expected = {
+        "X": [[1.0, None], [2.0, 3.0]],
+        "Zv": [[0, 0], [1, 1]],
+        "Zrv": [[0, [0, 1]]],
+        "hypers": [{"alpha": 0.5}],
+        "hooked_cgpms": {"1": [2.0, None]},
+    }
+    assert normalize(metadata) == expected
@@ -0,0 +1,35 @@
+import os
+import pytest
+import sys
+
+sys.path.insert(0, "scripts")
+
+from cgpm_model import read_metadata
+from checkpoint_writer import CheckpointWriter
+
+
+def test_writes_all_checkpoints(tmp_path):
+    paths = [str(tmp_path / f"t-{i}.json") for i in range(10)]
+    with CheckpointWriter(max_pending=2) as writer:
+        for i, path in enumerate(paths):
+            writer.submit({"X": [[float(i)]], "alpha": i}, path)
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(p) for p in paths)
+    for i, path in enumerate(paths):
+        assert read_metadata(path)["alpha"] == i
+
+
+def test_reports_errors(tmp_path):
+    writer = CheckpointWriter()
+    writer.submit({"alpha": 1}, str(tmp_path / "missing" / "t-0.json"))
+    with pytest.raises(RuntimeError):
+        writer.flush()
+    with pytest.raises(RuntimeError):
+        writer.close()
+
+
+def test_keeps_body_exception(tmp_path):
+    with pytest.raises(KeyError):
+        with CheckpointWriter() as writer:
+            writer.submit({"alpha": 1}, str(tmp_path / "missing" / "t-0.json"))
+            writer.queue.join()
+            raise KeyError("alpha")
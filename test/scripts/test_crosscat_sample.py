@@ -0,0 +1,120 @@
+import numpy as np
+import scipy.stats as stats
+import sys
+
+sys.path.insert(0, "scripts")
+
+import crosscat_sample
+
+from ast_export import view_clusters
+from edn_format import Keyword
+from sppl.transforms import Identity
+from sppl_import import convert_view
+
+VIEW = {
+    "weights": np.array([0.2, 0.5, 0.3]),
+    "distributions": [
+        {
+            "column": "x",
+            "type": "student-t",
+            "params": {
+                "student-t/degrees-of-freedom": np.array([30.0, 20.0, 10.0]),
+                "student-t/location": np.array([-5.0, 0.0, 5.0]),
+                "student-t/scale": np.array([1.0, 0.5, 2.0]),
+            },
+            "categories": None,
+        },
+        {
+            "column": "y",
+            "type": "categorical",
+            "params": {
+                "categorical/category->weight": np.array(
+                    [[0.9, 0.1, 0.0], [0.1, 0.1, 0.8], [0.0, 0.5, 0.5]]
+                )
+            },
+            "categories": ["a", "b", "c"],
+        },
+        {
+            "column": "z",
+            "type": "negative-binom",
+            "params": {
+                "negative-binom/n": np.array([2.0, 5.0, 9.0]),
+                "negative-binom/p": np.array([0.5, 0.3, 0.9]),
+            },
+            "categories": None,
+        },
+    ],
+}
+
+
+def test_draw_rows():
+    cdf = crosscat_sample.cumulative([[0.5, 0.5, 0.0], [0.0, 0.0, 1.0]])
+    rows = np.array([0, 0, 1, 1])
+    u = np.array([0.0, 0.75, 0.0, 0.99])
+    assert crosscat_sample.draw(cdf, rows, u).tolist() == [0, 1, 2, 2]
+
+
+def test_samples_match_sppl():
+    N = 20000
+    clusters = view_clusters(VIEW)
+    ast = {Keyword("multimixture/views"): [{Keyword("view/clusters"): clusters}]}
+    models = [crosscat_sample.compile_model(ast)]
+    rng = np.random.default_rng(1)
+    ours = crosscat_sample.sample_ensemble(models, ["x", "y", "z"], N, rng)
+
+    spe = convert_view(0, clusters)
+    columns = [Identity(c) for c in ["x", "y", "z"]]
+    prng = np.random.RandomState(1)
+    theirs = spe.sample_subset(columns, N, prng=prng)
+
+    for i, column in enumerate(["x", "y", "z"]):
+        theirs_column = np.array([row[columns[i]] for row in theirs])
+        ours_column = ours[column].to_numpy()
+        if column == "y":
+            for category in "abc":
+                expected = np.mean(theirs_column == category)
+                assert abs(np.mean(ours_column == category) - expected) < 0.02
+        else:
+            assert abs(np.mean(ours_column) - np.mean(theirs_column)) < 0.15
+            assert abs(np.std(ours_column) - np.std(theirs_column)) < 0.15
+
+
+def test_other_primitive_types():
+    N = 20000
+    weights = np.array([0.4, 0.6])
+    dists = {
+        "b": ("bernoulli", {"bernoulli/p": [0.2, 0.7]}),
+        "be": ("beta", {"beta/alpha": [2.0, 5.0], "beta/beta": [3.0, 1.0]}),
+        "l": ("lomax", {"lomax/c": [6.0, 9.0], "lomax/scale": [2.0, 4.0]}),
+        "g": ("geometric", {"geometric/p": [0.3, 0.6]}),
+    }
+    view = {
+        "weights": weights,
+        "distributions": [
+            {
+                "column": column,
+                "type": dist_type,
+                "params": {k: np.array(v) for k, v in params.items()},
+                "categories": None,
+            }
+            for column, (dist_type, params) in dists.items()
+        ],
+    }
+    ast = {
+        Keyword("multimixture/views"): [{Keyword("view/clusters"): view_clusters(view)}]
+    }
+    models = [crosscat_sample.compile_model(ast)]
+    rng = np.random.default_rng(1)
+    samples = crosscat_sample.sample_ensemble(models, list(dists), N, rng)
+
+    expected = {
+        "b": [stats.bernoulli(p) for p in [0.2, 0.7]],
+        "be": [stats.beta(2.0, 3.0), stats.beta(5.0, 1.0)],
+        "l": [stats.lomax(6.0, scale=2.0), stats.lomax(9.0, scale=4.0)],
+        "g": [stats.geom(p, loc=-1) for p in [0.3, 0.6]],
+    }
+    for column, components in expected.items():
+        mean = sum(w * d.mean() for w, d in zip(weights, components))
+        assert abs(samples[column].mean() - mean) < 0.05
+    assert set(samples["b"]) == {0, 1}
+    assert samples["g"].min() == 0
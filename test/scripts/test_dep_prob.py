@@ -0,0 +1,53 @@
+import io
+import itertools
+import json
+import numpy as np
+import sys
+
+sys.path.insert(0, "scripts")
+
+from dep_prob import dep_probs
+from dep_prob import write_series
+
+COLUMNS = ["a", "b", "c", "d"]
+
+
+def models(n):
+    rng = np.random.RandomState(0)
+    return [
+        {"Zv": [[c, int(v)] for c, v in enumerate(rng.choice([0, 4, 7], 4))]}
+        for _ in range(n)
+    ]
+
+
+def test_dep_probs():
+    cgpm_dicts = models(20)
+    deps = dep_probs(cgpm_dicts, COLUMNS)
+    for i, j in itertools.permutations(range(len(COLUMNS)), 2):
+        expected = np.mean([dict(m["Zv"])[i] == dict(m["Zv"])[j] for m in cgpm_dicts])
+        assert deps[COLUMNS[i]][COLUMNS[j]] == expected
+    assert COLUMNS[0] not in deps[COLUMNS[0]]
+
+
+def test_series():
+    cgpm_dicts = models(5)
+    f = io.StringIO()
+    write_series(iter(cgpm_dicts), COLUMNS, f, chunk=2)
+    series = json.loads(f.getvalue())
+    assert series == [dep_probs([m], COLUMNS) for m in cgpm_dicts]
+
+
+def test_series_with_growing_columns():
+    cgpm_dicts = [
+        {"col_names": ["a", "b"], "Zv": [[0, 0], [1, 0]]},
+        {"col_names": ["a", "b", "c"], "Zv": [[0, 0], [1, 1], [2, 1]]},
+        {"col_names": ["a", "b", "c", "d"], "Zv": [[0, 0], [1, 1], [2, 1]]},
+    ]
+    f = io.StringIO()
+    write_series(iter(cgpm_dicts), COLUMNS, f, chunk=3)
+    series = json.loads(f.getvalue())
+    assert series[0] == {"a": {"b": 1.0}, "b": {"a": 1.0}}
+    assert series[1]["b"] == {"a": 0.0, "c": 1.0}
+    # "d" isn't assigned to a view yet, so it depends on no other column.
+    assert series[2]["d"] == {"a": 0.0, "b": 0.0, "c": 0.0}
+    assert dep_probs(cgpm_dicts[2:], COLUMNS)["d"] == series[2]["d"]
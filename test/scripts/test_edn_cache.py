@@ -0,0 +1,38 @@
+import os
+import sys
+
+sys.path.insert(0, "scripts")
+
+from edn_cache import CACHE_DIR
+from edn_cache import load_edn
+from edn_format import Keyword
+
+
+def cache_files(tmp_path):
+    return sorted(os.listdir(tmp_path / CACHE_DIR))
+
+
+def test_load_edn_caches_parse(tmp_path):
+    path = tmp_path / "schema.edn"
+    path.write_text('{:foo :numerical "bar" :nominal}')
+    with open(path) as f:
+        first = load_edn(f)
+    assert len(cache_files(tmp_path)) == 1
+    with open(path) as f:
+        second = load_edn(f)
+    assert first == second
+    assert second[Keyword("foo")] == Keyword("numerical")
+
+
+def test_load_edn_invalidates_on_change(tmp_path):
+    path = tmp_path / "schema.edn"
+    path.write_text("{:foo :numerical}")
+    with open(path) as f:
+        load_edn(f)
+    old_cache = cache_files(tmp_path)
+    path.write_text("{:foo :nominal}")
+    with open(path) as f:
+        assert load_edn(f) == {Keyword("foo"): Keyword("nominal")}
+    new_cache = cache_files(tmp_path)
+    assert len(new_cache) == 1
+    assert new_cache != old_cache
@@ -0,0 +1,48 @@
+import math
+import numpy as np
+import pandas as pd
+import sys
+
+sys.path.insert(0, "scripts")
+
+import linear_stats
+
+
+def test_numerical_stats_match_linregress():
+    rng = np.random.default_rng(0)
+    n = 200
+    x = rng.normal(size=n)
+    df = pd.DataFrame(
+        {
+            "a": x,
+            "b": 1e6 + 3 * x + rng.normal(size=n),
+            "c": rng.exponential(size=n),
+            "d": np.where(np.arange(n) < 3, rng.normal(size=n), np.nan),
+        }
+    )
+    df.loc[rng.choice(n, 40, replace=False), "a"] = np.nan
+    df.loc[rng.choice(n, 40, replace=False), "c"] = np.nan
+    df.loc[1, "a"] = np.nan
+
+    results = linear_stats.numerical_stats(df)
+    for c1 in df.columns:
+        for c2 in df.columns:
+            if c1 == c2:
+                continue
+            pair_df = df[[c1, c2]].dropna()
+            if len(pair_df) <= 1:
+                expected = linear_stats.placeholder_stats(["numerical"] * 2)
+            else:
+                expected = linear_stats.lin_reg(pair_df[c1].values, pair_df[c2].values)
+            for key, value in expected.items():
+                assert math.isclose(
+                    results[(c1, c2)][key], value, rel_tol=1e-6, abs_tol=1e-9
+                ), (c1, c2, key)
+
+
+def test_numerical_stats_placeholders():
+    df = pd.DataFrame({"x": [1.0, 1.0, 1.0], "y": [1.0, 2.0, np.nan]})
+    results = linear_stats.numerical_stats(df)
+    assert results[("x", "y")] == linear_stats.placeholder_stats(["numerical"] * 2)
+    assert results[("y", "x")]["p-value"] == 1.0
+    assert results[("y", "x")]["slope"] == 0.0
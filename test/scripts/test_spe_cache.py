@@ -0,0 +1,43 @@
+import copyreg
+import json
+import os
+import sys
+
+sys.path.insert(0, "scripts")
+
+from pickle_cache import file_path
+from spe_cache import CACHE_DIR
+from spe_cache import load_spe
+from spe_cache import load_spe_path
+from sppl.compilers.spe_to_dict import spe_to_dict
+from sppl.distributions import norm
+from sppl.spe import ProductSPE
+from sppl.transforms import Id
+from sppl.transforms import Identity
+
+
+def test_load_spe_caches_build(tmp_path):
+    X, Y = Id("X"), Id("Y")
+    spe = ProductSPE([X >> norm(loc=0, scale=1), Y >> norm(loc=1, scale=2)])
+    path = tmp_path / "model.json"
+    path.write_text(json.dumps(spe_to_dict(spe)))
+    with open(path) as f:
+        first = load_spe(f)
+    assert len(os.listdir(tmp_path / CACHE_DIR)) == 1
+    assert Identity not in copyreg.dispatch_table
+    with open(path) as f:
+        second = load_spe(f)
+    assert spe_to_dict(second) == spe_to_dict(first)
+    assert second.logprob(X < 0) == spe.logprob(X < 0)
+    assert second.logprob((X < 0) & (Y > 1)) == spe.logprob((X < 0) & (Y > 1))
+
+
+def test_load_spe_path(tmp_path):
+    X = Id("X")
+    spe = X >> norm(loc=0, scale=1)
+    path = tmp_path / "model.json"
+    path.write_text(json.dumps(spe_to_dict(spe)))
+    with open(path) as f:
+        assert file_path(f) == str(path)
+        load_spe(f)
+    assert load_spe_path(str(path)).logprob(X < 0) == spe.logprob(X < 0)
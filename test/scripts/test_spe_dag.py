@@ -0,0 +1,44 @@
+import sys
+
+sys.path.insert(0, "scripts")
+
+import spe_dag
+
+from sppl.compilers.spe_to_dict import spe_to_dict
+from sppl.distributions import norm
+from sppl.transforms import Id
+
+
+def leaf(name, loc):
+    return spe_to_dict((Id(name) >> norm(loc=loc, scale=1)))
+
+
+def product(*children):
+    return {"class": "ProductSPE", "children": list(children)}
+
+
+def test_intern_shares_identical_subtrees():
+    padding = leaf("Y", 0)
+    tree = {
+        "class": "SumSPE",
+        "children": [
+            product(leaf("X", 1), leaf("Y", 0)),
+            product(leaf("X", 2), padding),
+            product(leaf("X", 1), padding),
+        ],
+        "weights": [-1.0986122886681098] * 3,
+    }
+    table = spe_dag.NodeTable()
+    root = table.intern(tree)
+    # X=1, X=2, Y=0, the two distinct products and the sum.
+    assert len(table.nodes) == 6
+    assert root == len(table.nodes) - 1
+
+    dag = table.to_dag(root)
+    assert spe_dag.is_dag(dag)
+    spe = spe_dag.spe_from_json(dag)
+    assert spe.children[0] is spe.children[2]
+    assert spe.children[0].children[1] is spe.children[1].children[1]
+
+    assert spe_to_dict(spe) == spe_to_dict(spe_dag.spe_from_json(tree))
+    assert spe_dag.spe_to_tree(spe) == spe_to_dict(spe)
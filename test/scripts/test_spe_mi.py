@@ -0,0 +1,128 @@
+import itertools
+import json
+import math
+import multiprocessing
+import numpy as np
+import sys
+
+sys.path.insert(0, "scripts")
+
+import spe_mi
+
+from spe_cache import load_spe_path
+from sppl.compilers.spe_to_dict import spe_to_dict
+from sppl.distributions import choice
+from sppl.distributions import norm
+from sppl.spe import ProductSPE
+from sppl.spe import SumSPE
+from sppl.transforms import Id
+
+
+def mixture():
+    X, Y, Z = Id("x"), Id("y"), Id("z")
+    clusters = [
+        ProductSPE(
+            [
+                X >> norm(loc=loc, scale=1),
+                Y >> choice({"a": p, "b": 1 - p}),
+                Z >> norm(loc=-loc, scale=2),
+            ]
+        )
+        for loc, p in [(-2, 0.9), (1, 0.3), (3, 0.5)]
+    ]
+    return SumSPE(clusters, [math.log(0.2), math.log(0.3), math.log(0.5)])
+
+
+def mixture_file(tmp_path):
+    """Write `mixture()` to a model file and return its path and the model
+    loaded from it, as the workers load it."""
+    path = str(tmp_path / "mixture.json")
+    with open(path, "w") as f:
+        json.dump(spe_to_dict(mixture()), f)
+    return path, load_spe_path(path)
+
+
+def test_pairwise_mi_matches_sppl():
+    spe = mixture()
+    configs = {"x": 0.5, "y": ["a"], "z": -1.0}
+    cols = ["x", "y", "z"]
+    mi = spe_mi.pairwise_mi(spe, configs, cols)
+    for c1, c2 in itertools.combinations(cols, 2):
+        expected = spe.mutual_information(
+            spe_mi.get_predicate(c1, configs[c1]),
+            spe_mi.get_predicate(c2, configs[c2]),
+        )
+        assert abs(mi[c1][c2] - expected) < 1e-9
+        assert mi[c2][c1] == mi[c1][c2]
+
+
+def test_event_cache_is_lru():
+    events = spe_mi.EventCache(mixture(), maxsize=2)
+    a, b, c = Id("x") > 0, Id("x") > 1, Id("x") > 2
+    events.logprob(a)
+    events.logprob(b)
+    events.logprob(a)
+    events.logprob(c)
+    assert list(events.cache) == [a, c]
+
+
+def test_pairwise_mi_does_not_depend_on_workers(tmp_path):
+    path, spe = mixture_file(tmp_path)
+    configs = {"x": 0.5, "y": ["a"], "z": -1.0}
+    cols = ["x", "y", "z"]
+    assert spe_mi.pairwise_mi(
+        spe, configs, cols, workers=2, model_path=path
+    ) == spe_mi.pairwise_mi(spe, configs, cols, workers=1)
+    skipped = spe_mi.iter_pairwise_mi(spe, configs, cols, skip={("x", "y")})
+    assert sorted((c1, c2) for c1, c2, _ in skipped) == [("x", "z"), ("y", "z")]
+
+
+def test_pairwise_mi_under_spawn(tmp_path, monkeypatch):
+    path, spe = mixture_file(tmp_path)
+    configs = {"x": 0.5, "y": ["a"], "z": -1.0}
+    cols = ["x", "y", "z"]
+    expected = spe_mi.pairwise_mi(spe, configs, cols)
+    monkeypatch.setattr(spe_mi, "multiprocessing", multiprocessing.get_context("spawn"))
+    mi = spe_mi.pairwise_mi(spe, configs, cols, workers=2, model_path=path)
+    assert mi == expected
+
+
+def test_mi_from_counts_of_exact_probabilities():
+    spe = mixture()
+    configs = {"x": 0.5, "y": ["a"], "z": -1.0}
+    cols = ["x", "y", "z"]
+    predicates = [spe_mi.get_predicate(c, configs[c]) for c in cols]
+    probabilities = [[spe.prob(A & B) for B in predicates] for A in predicates]
+    mi, se = spe_mi.mi_from_counts(np.array(probabilities) * 1000, 1000)
+    exact = spe_mi.pairwise_mi(spe, configs, cols)
+    for i, c1 in enumerate(cols):
+        for j, c2 in enumerate(cols):
+            if i != j:
+                assert abs(mi[i, j] - exact[c1][c2]) < 1e-9
+                assert se[i, j] > 0
+
+
+def test_monte_carlo_mi(tmp_path):
+    path, spe = mixture_file(tmp_path)
+    configs = {"x": 0.5, "y": ["a"], "z": -1.0}
+    cols = ["x", "y", "z"]
+    mi, se = spe_mi.monte_carlo_mi(spe, configs, cols, 4000, chunk_size=1000)
+    assert (mi, se) == spe_mi.monte_carlo_mi(
+        spe, configs, cols, 4000, workers=2, chunk_size=1000, model_path=path
+    )
+    exact = spe_mi.pairwise_mi(spe, configs, cols)
+    for c1, c2 in itertools.combinations(cols, 2):
+        assert mi[c1][c2] == mi[c2][c1]
+        assert abs(mi[c1][c2] - exact[c1][c2]) < 5 * se[c1][c2] + 0.005
+
+
+def test_monte_carlo_mi_under_spawn(tmp_path, monkeypatch):
+    path, spe = mixture_file(tmp_path)
+    configs = {"x": 0.5, "y": ["a"], "z": -1.0}
+    cols = ["x", "y", "z"]
+    expected = spe_mi.monte_carlo_mi(spe, configs, cols, 2000, chunk_size=500)
+    monkeypatch.setattr(spe_mi, "multiprocessing", multiprocessing.get_context("spawn"))
+    estimates = spe_mi.monte_carlo_mi(
+        spe, configs, cols, 2000, workers=2, chunk_size=500, model_path=path
+    )
+    assert estimates == expected
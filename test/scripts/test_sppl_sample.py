@@ -0,0 +1,41 @@
+import json
+import multiprocessing
+import sys
+
+sys.path.insert(0, "scripts")
+
+import sppl_sample
+
+from sppl.compilers.spe_to_dict import spe_to_dict
+from sppl.distributions import norm
+from sppl.spe import ProductSPE
+from sppl.transforms import Id
+
+
+def test_chunks_cover_sample_count():
+    assert sppl_sample.chunks(25, 10) == [(0, 10), (1, 10), (2, 5)]
+    assert sppl_sample.chunks(0, 10) == []
+
+
+def test_chunks_are_seeded_by_index():
+    X, Y = Id("X"), Id("Y")
+    spe = ProductSPE([X >> norm(loc=0, scale=1), Y >> norm(loc=1, scale=2)])
+    sppl_sample.init_worker(spe, ["X", "Y"], 3, "csv")
+    first = sppl_sample.sample_chunk((1, 5))
+    assert sppl_sample.sample_chunk((0, 5)) != first
+    assert sppl_sample.sample_chunk((1, 5)) == first
+    assert len(first.splitlines()) == 5
+
+
+def test_workers_load_the_model_under_spawn(tmp_path, monkeypatch):
+    X, Y = Id("X"), Id("Y")
+    spe = ProductSPE([X >> norm(loc=0, scale=1), Y >> norm(loc=1, scale=2)])
+    path = tmp_path / "model.json"
+    path.write_text(json.dumps(spe_to_dict(spe)))
+    jobs = sppl_sample.chunks(12, 5)
+    expected = list(sppl_sample.sample_chunks(spe, ["X", "Y"], jobs, 3, "csv"))
+    monkeypatch.setattr(
+        sppl_sample, "multiprocessing", multiprocessing.get_context("spawn")
+    )
+    chunks = sppl_sample.sample_chunks(str(path), ["X", "Y"], jobs, 3, "csv", workers=2)
+    assert list(chunks) == expected
@@ -0,0 +1,65 @@
+import json
+import socket
+import sys
+import threading
+
+sys.path.insert(0, "scripts")
+
+from stream_summary import FileSink
+from stream_summary import SocketSink
+from stream_summary import SummaryHook
+from stream_summary import open_sink
+
+
+class Model:
+    incorporated_rows = 0
+
+    def summary(self):
+        return {"rows": self.incorporated_rows}
+
+
+def test_summary_cadence(tmp_path):
+    path = str(tmp_path / "summary.jsonl")
+    sink = open_sink(path)
+    assert isinstance(sink, FileSink)
+    hook = SummaryHook(sink, every=10)
+    model = Model()
+    for rows in [3, 7, 10, 14, 25, 26]:
+        model.incorporated_rows = rows
+        hook(model)
+    hook(model, done=True)
+    sink.close()
+    with open(path) as f:
+        lines = [json.loads(line) for line in f]
+    assert [line["rows"] for line in lines] == [3, 10, 25, 26]
+    assert lines[-1]["done"]
+
+
+def test_unreachable_socket_drops_summaries():
+    sink = open_sink("unix:/nonexistent/summary.sock")
+    sink.write("{}\n")
+    sink.close()
+
+
+def test_slow_socket_reader_does_not_block(tmp_path):
+    path = str(tmp_path / "summary.sock")
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(1)
+    sink = open_sink("unix:" + path)
+    assert isinstance(sink, SocketSink)
+    connection, _ = server.accept()
+    # Nothing is read while these are written, so most of them are dropped.
+    lines = [json.dumps({"i": i, "padding": "x" * 100000}) + "\n" for i in range(50)]
+    for line in lines:
+        sink.write(line)
+    received = []
+    reader = threading.Thread(target=lambda: received.extend(connection.makefile()))
+    reader.start()
+    sink.close()
+    reader.join()
+    connection.close()
+    server.close()
+    assert 0 < len(received) < len(lines)
+    assert received[0] == lines[0]
+    assert all(line in lines for line in received)
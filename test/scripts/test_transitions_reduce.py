@@ -0,0 +1,43 @@
+import io
+import json
+import pytest
+import sys
+
+sys.path.insert(0, "scripts")
+
+from transitions_reduce import iter_json_array
+from transitions_reduce import reduce_iteration
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1 << 16])
+def test_iter_json_array(chunk_size):
+    values = [{"a": {"b": 0.5}}, 12, [1, 2], "x]", {}]
+    text = " [ " + " ,\n".join(json.dumps(v) for v in values) + " ]\n"
+    f = io.StringIO(text)
+    assert list(iter_json_array(f, chunk_size=chunk_size)) == values
+    assert list(iter_json_array(io.StringIO("[ ]"))) == []
+
+
+class CountingReader(io.StringIO):
+    reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return super().read(size)
+
+
+def test_iter_json_array_reads_large_elements_geometrically():
+    value = {str(i): {str(j): 0.5 for j in range(100)} for i in range(100)}
+    f = CountingReader(json.dumps([value, value]))
+    assert list(iter_json_array(f, chunk_size=16)) == [value, value]
+    assert f.reads < 20
+
+
+def test_reduce_iteration():
+    dep_probs = [{"a": {"b": 1.0}, "b": {"a": 1.0}}, {"a": {"b": 0.0}, "b": {"a": 0.0}}]
+    assert reduce_iteration(dep_probs) == {"a": {"b": 0.5}, "b": {"a": 0.5}}
+    mi = [{"configs": {"n": 1}, "mi": m} for m in dep_probs]
+    assert reduce_iteration(mi) == {
+        "configs": {"n": 1},
+        "mi": {"a": {"b": 0.5}, "b": {"a": 0.5}},
+    }